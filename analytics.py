@@ -0,0 +1,574 @@
+"""
+Reporting queries against OUR_DB.
+
+Historical counts come from `fault_daily_rollup`: one row per
+(day, school, fault_type, severity, technician) holding how many faults
+were opened / closed that day and the summed resolution time of the closed
+ones. It is maintained incrementally in the same transaction as the fault
+write (record_opened / record_closed / record_reopened), so a report scans
+days x dimensions instead of every fault ever filed. School is resolved from
+Adon Locker DB once, when the event is recorded.
+
+Figures about what is open *right now* (urgent open, open per technician)
+stay live queries over `faults`; the open set is small.
+
+Rebuild the rollup from scratch with:
+    python analytics.py backfill
+"""
+
+import os
+import sys
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import (
+    Column, Date, DateTime, Float, Index, Integer, MetaData, String, Table, bindparam, text,
+)
+
+import db as adon_db
+
+UNKNOWN_SCHOOL = "לא ידוע"
+UNASSIGNED_TECHNICIAN = "לא הוקצה"
+
+
+# ============================================================================
+# Daily rollup
+# ============================================================================
+
+metadata = MetaData()
+
+# '' (not NULL) for unknown school / no technician, so they can be PK parts.
+fault_daily_rollup = Table(
+    "fault_daily_rollup", metadata,
+    Column("day", Date, primary_key=True),
+    Column("school", String, primary_key=True),
+    Column("fault_type", String, primary_key=True),
+    Column("severity", Integer, primary_key=True),
+    Column("technician", String, primary_key=True),
+    Column("opened", Integer, nullable=False, default=0),
+    Column("closed", Integer, nullable=False, default=0),
+    Column("resolution_seconds", Float, nullable=False, default=0.0),
+    Index("ix_fault_daily_rollup_school_day", "school", "day"),
+)
+
+# One row once backfill() has built the rollup. Live writes fill the rollup
+# too, so "has rows" doesn't mean "has history".
+rollup_built = Table(
+    "fault_daily_rollup_built", metadata,
+    Column("id", Integer, primary_key=True),   # always 1
+    Column("built_at", DateTime, nullable=False),
+)
+
+_UPSERT_SQL = text("""
+    INSERT INTO fault_daily_rollup
+        (day, school, fault_type, severity, technician, opened, closed, resolution_seconds)
+    VALUES
+        (:day, :school, :fault_type, :severity, :technician, :opened, :closed, :resolution_seconds)
+    ON CONFLICT (day, school, fault_type, severity, technician) DO UPDATE SET
+        opened = fault_daily_rollup.opened + EXCLUDED.opened,
+        closed = fault_daily_rollup.closed + EXCLUDED.closed,
+        resolution_seconds = fault_daily_rollup.resolution_seconds + EXCLUDED.resolution_seconds
+""")
+
+
+def _school_of(student_id: str) -> str:
+    # Never let an Adon hiccup fail the fault write; the event lands under ''.
+    try:
+        student = adon_db.get_student_by_id(student_id) or {}
+    except Exception:
+        return ""
+    return student.get("school_name") or ""
+
+
+def _record(conn, fault, day: datetime, technician, opened=0, closed=0, resolution_seconds=0.0) -> None:
+    conn.execute(_UPSERT_SQL, {
+        "day": day.date(),
+        "school": _school_of(fault.student_id_ext),
+        "fault_type": fault.fault_type,
+        "severity": fault.severity,
+        "technician": technician or "",
+        "opened": opened,
+        "closed": closed,
+        "resolution_seconds": resolution_seconds,
+    })
+
+
+def _resolution_seconds(created_at, resolved_at) -> float:
+    if not created_at or not resolved_at:
+        return 0.0
+    return max((resolved_at - created_at).total_seconds(), 0.0)
+
+
+def record_opened(conn, fault) -> None:
+    """Count a newly created fault. Call after flush (created_at set), before commit."""
+    _record(conn, fault, fault.created_at or datetime.utcnow(), fault.assigned_technician, opened=1)
+
+
+def record_opened_many(conn, faults) -> None:
+    """record_opened for a batch of new faults, as one executemany (one row per rollup key)."""
+    opened = Counter(
+        ((f.created_at or datetime.utcnow()).date(), _school_of(f.student_id_ext),
+         f.fault_type, f.severity, f.assigned_technician or "")
+        for f in faults
+    )
+    if opened:
+        conn.execute(_UPSERT_SQL, [
+            {"day": day, "school": school, "fault_type": fault_type, "severity": severity,
+             "technician": technician, "opened": n, "closed": 0, "resolution_seconds": 0.0}
+            for (day, school, fault_type, severity, technician), n in opened.items()
+        ])
+
+
+def record_closed(conn, fault) -> None:
+    """
+    Count an Open -> Closed transition on the day it was resolved. Remembers
+    the technician it was counted under on the fault (resolved_technician),
+    so a reopen undoes that row even if the technician changed meanwhile.
+    """
+    fault.resolved_technician = fault.assigned_technician or ""
+    _record(conn, fault, fault.resolved_at or datetime.utcnow(), fault.resolved_technician, closed=1,
+            resolution_seconds=_resolution_seconds(fault.created_at, fault.resolved_at))
+
+
+def record_reopened(conn, fault, resolved_at, technician) -> None:
+    """
+    Undo record_closed() for a Closed -> Open transition (pass the pre-reopen
+    values). `technician` is only used for faults closed before
+    resolved_technician was recorded.
+    """
+    counted_under = fault.resolved_technician
+    fault.resolved_technician = None
+    if not resolved_at:
+        return
+    _record(conn, fault, resolved_at, technician if counted_under is None else counted_under, closed=-1,
+            resolution_seconds=-_resolution_seconds(fault.created_at, resolved_at))
+
+
+def record_status_change(conn, fault, old_status, old_resolved_at, old_technician) -> None:
+    """Apply whatever rollup delta a status update implies (none if unchanged)."""
+    if fault.status == old_status:
+        return
+    if fault.status == "Closed":
+        record_closed(conn, fault)
+    elif old_status == "Closed":
+        record_reopened(conn, fault, old_resolved_at, old_technician)
+
+
+_BACKFILL_OPENED_SQL = text("""
+    SELECT CAST(created_at AS DATE), student_id_ext, fault_type, severity, COUNT(*)
+    FROM faults WHERE created_at IS NOT NULL
+    GROUP BY 1, 2, 3, 4
+""")
+
+_BACKFILL_CLOSED_SQL = text("""
+    SELECT CAST(resolved_at AS DATE), student_id_ext, fault_type, severity,
+           COALESCE(resolved_technician, assigned_technician, ''), COUNT(*),
+           COALESCE(SUM(EXTRACT(EPOCH FROM resolved_at - created_at)), 0)
+    FROM faults WHERE status = 'Closed' AND resolved_at IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5
+""")
+
+
+def backfill(engine, only_if_unbuilt: bool = False) -> Optional[int]:
+    """
+    Rebuild fault_daily_rollup from `faults`. Returns the number of rollup rows
+    written, or None if `only_if_unbuilt` and a backfill already ran.
+
+    Holds a SHARE lock on faults for the duration, so live writes (and their
+    rollup upserts) wait for the rebuild instead of being double-counted or lost.
+    With `only_if_unbuilt`, an earlier backfill is spotted (fault_daily_rollup_built)
+    before locking anything, so a worker boot doesn't hold up fault writes.
+    """
+    _built = text("SELECT 1 FROM fault_daily_rollup_built")
+    if only_if_unbuilt:
+        with engine.connect() as conn:
+            if conn.execute(_built).first():
+                return None
+
+    with engine.begin() as conn:
+        conn.execute(text("LOCK TABLE faults IN SHARE MODE"))
+        conn.execute(text("LOCK TABLE fault_daily_rollup IN EXCLUSIVE MODE"))
+        if only_if_unbuilt and conn.execute(_built).first():  # built while we waited
+            return None
+
+        students = adon_db.get_students_by_id()
+        rows = {}
+
+        def bucket(day, student_id, fault_type, severity, technician):
+            school = (students.get(student_id) or {}).get("school_name") or ""
+            key = (day, school, fault_type, severity, technician)
+            return rows.setdefault(key, {"opened": 0, "closed": 0, "resolution_seconds": 0.0})
+
+        # Faults are always created unassigned (form and bot alike), so the
+        # opened side is keyed by technician '' just as record_opened() does.
+        for day, student_id, fault_type, severity, n in conn.execute(_BACKFILL_OPENED_SQL):
+            bucket(day, student_id, fault_type, severity, "")["opened"] += int(n)
+        for day, student_id, fault_type, severity, tech, n, secs in conn.execute(_BACKFILL_CLOSED_SQL):
+            entry = bucket(day, student_id, fault_type, severity, tech)
+            entry["closed"] += int(n)
+            entry["resolution_seconds"] += float(secs)
+
+        conn.execute(fault_daily_rollup.delete())
+        if rows:
+            conn.execute(fault_daily_rollup.insert(), [
+                {"day": d, "school": sc, "fault_type": ft, "severity": sev, "technician": tech, **v}
+                for (d, sc, ft, sev, tech), v in rows.items()
+            ])
+        conn.execute(rollup_built.delete())
+        conn.execute(rollup_built.insert(), {"id": 1, "built_at": datetime.utcnow()})
+        return len(rows)
+
+
+def ensure_schema(engine) -> None:
+    """Create the rollup table and the report indexes on `faults` if missing."""
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_faults_closed_resolved_at "
+            "ON faults (resolved_at) WHERE status = 'Closed'"
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_faults_created_at ON faults (created_at)"))
+
+
+# ============================================================================
+# Reports
+# ============================================================================
+
+def _where(student_ids: Optional[list], *conditions: str) -> str:
+    clauses = list(conditions)
+    if student_ids is not None:
+        clauses.append("student_id_ext IN :student_ids")
+    return ("WHERE " + " AND ".join(clauses)) if clauses else ""
+
+
+def _run(conn, sql: str, student_ids: Optional[list], **params):
+    stmt = text(sql)
+    if student_ids is not None:
+        stmt = stmt.bindparams(bindparam("student_ids", expanding=True))
+        params["student_ids"] = student_ids
+    return conn.execute(stmt, params).fetchall()
+
+
+def _label_counts(rows, default_label="ללא") -> list[dict]:
+    return [
+        {"label": str(k) if k is not None else default_label, "count": int(n)}
+        for k, n in rows
+    ]
+
+
+def _rollup_where(school: Optional[str], *conditions: str) -> str:
+    clauses = list(conditions)
+    if school is not None:
+        clauses.append("school = :school")
+    return ("WHERE " + " AND ".join(clauses)) if clauses else ""
+
+
+def report_stats(conn, school: Optional[str] = None, student_ids: Optional[list] = None) -> dict:
+    """
+    Dashboard aggregates, optionally restricted to one school.
+
+    Historical counts read fault_daily_rollup (filtered by `school`); the live
+    open-fault figures read `faults` filtered by that school's `student_ids`.
+    Same keys/shape /api/reports/stats has always returned (minus the filter
+    echo and school list, which the route adds).
+    """
+    params = {"school": school} if school is not None else {}
+
+    opened, closed = conn.execute(text(f"""
+        SELECT COALESCE(SUM(opened), 0), COALESCE(SUM(closed), 0)
+        FROM fault_daily_rollup {_rollup_where(school)}
+    """), params).one()
+
+    def rollup_counts(column):
+        return _label_counts(conn.execute(text(f"""
+            SELECT {column}, SUM(opened) FROM fault_daily_rollup {_rollup_where(school)}
+            GROUP BY {column} HAVING SUM(opened) > 0 ORDER BY SUM(opened) DESC
+        """), params).fetchall())
+
+    by_type = rollup_counts("fault_type")
+    by_severity = rollup_counts("severity")
+
+    # Last 12 months that actually have faults, oldest first.
+    month_rows = conn.execute(text(f"""
+        SELECT to_char(date_trunc('month', day), 'YYYY-MM') AS bucket, SUM(opened)
+        FROM fault_daily_rollup {_rollup_where(school)}
+        GROUP BY bucket HAVING SUM(opened) > 0 ORDER BY bucket DESC LIMIT 12
+    """), params).fetchall()
+    by_month = _label_counts(reversed(month_rows))
+
+    by_school = []
+    if school is None:
+        by_school = [
+            {"label": row["label"] or UNKNOWN_SCHOOL, "count": row["count"]}
+            for row in rollup_counts("school")
+        ]
+
+    # Live: what is open right now. Not opened - closed from the rollup, which
+    # drifts (legacy Closed faults without resolved_at were never counted closed).
+    if student_ids is not None and not student_ids:
+        open_now, urgent_open, by_technician = 0, 0, []
+    else:
+        open_now, urgent_open = _run(conn, f"""
+            SELECT COUNT(*), COUNT(*) FILTER (WHERE is_urgent)
+            FROM faults {_where(student_ids, "status = 'Open'")}
+        """, student_ids)[0]
+        by_technician = _label_counts(_run(conn, f"""
+            SELECT COALESCE(assigned_technician, :unassigned), COUNT(*)
+            FROM faults {_where(student_ids, "status = 'Open'")}
+            GROUP BY 1 ORDER BY COUNT(*) DESC
+        """, student_ids, unassigned=UNASSIGNED_TECHNICIAN))
+
+    return {
+        "total": int(opened),
+        "open": int(open_now),
+        "closed": int(closed),
+        "urgent_open": int(urgent_open),
+        "by_type": by_type,
+        "by_severity": by_severity,
+        "by_month": by_month,
+        "by_school": by_school,
+        "by_technician": by_technician,
+    }
+
+
+# ============================================================================
+# Resolution time (MTTR / percentiles / SLA)
+# ============================================================================
+
+RESOLUTION_SLA_HOURS = float(os.environ.get("RESOLUTION_SLA_HOURS", "48"))
+
+# group_by -> the one faults column we need per row to derive the label.
+RESOLUTION_GROUPS = {
+    "fault_type": "fault_type",
+    "technician": "COALESCE(assigned_technician, '')",
+    "school": "student_id_ext",
+    "region": "student_id_ext",
+    "lock_type": "COALESCE(locker_id, '')",
+}
+
+_LOCK_TYPE_LABELS = {"digital": "דיגיטלי", "mechanical": "מכני"}
+
+
+def _group_labeler(group_by: str, keys):
+    """Function mapping a raw key (see RESOLUTION_GROUPS) among `keys` to its display label."""
+    if group_by in ("school", "region"):
+        students = adon_db.get_students_by_id()
+
+        def school(student_id):
+            return (students.get(student_id) or {}).get("school_name")
+
+        if group_by == "school":
+            return lambda k: school(k) or UNKNOWN_SCHOOL
+        return lambda k: adon_db.get_region_for_school(school(k))
+    if group_by == "lock_type":
+        lockers = adon_db.get_lockers_by_ids(keys)
+        return lambda k: _LOCK_TYPE_LABELS.get((lockers.get(k) or {}).get("lock_type"), "לא ידוע")
+    if group_by == "technician":
+        return lambda k: k or UNASSIGNED_TECHNICIAN
+    return lambda k: k
+
+
+def _duration_summary(codes: np.ndarray, seconds: np.ndarray, n_groups: int, sla_seconds: float) -> dict:
+    """
+    Per-group count / mean / median / p90 / p99 / SLA breach rate, all at once.
+
+    One lexsort by (group, duration) lays every group out as a contiguous
+    sorted run, so each percentile is a single fancy-index + lerp across all
+    groups (same linear interpolation as np.percentile).
+    """
+    counts = np.bincount(codes, minlength=n_groups)
+    order = np.lexsort((seconds, codes))
+    ordered = seconds[order]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    def percentile(q):
+        pos = starts + q * (counts - 1)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.ceil(pos).astype(np.int64)
+        return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+    hours = 1 / 3600.0
+    return {
+        "count": counts,
+        "mean_hours": np.bincount(codes, weights=seconds, minlength=n_groups) / counts * hours,
+        "median_hours": percentile(0.5) * hours,
+        "p90_hours": percentile(0.9) * hours,
+        "p99_hours": percentile(0.99) * hours,
+        "sla_breach_rate": np.bincount(codes, weights=seconds > sla_seconds, minlength=n_groups) / counts,
+    }
+
+
+def _summary_row(summary: dict, i: int) -> dict:
+    return {
+        "count": int(summary["count"][i]),
+        **{k: round(float(v[i]), 2) for k, v in summary.items() if k.endswith("_hours")},
+        "sla_breach_rate": round(float(summary["sla_breach_rate"][i]), 4),
+    }
+
+
+def resolution_stats(conn, start: datetime, end: datetime, group_by: str,
+                     student_ids: Optional[list] = None,
+                     sla_hours: float = RESOLUTION_SLA_HOURS) -> dict:
+    """
+    Time-to-resolve over faults closed in [start, end), overall and per `group_by`.
+
+    The window (and school filter) are applied in SQL, which returns only
+    (group key, seconds) pairs; everything else is vectorised NumPy.
+    """
+    empty = {"count": 0, "mean_hours": None, "median_hours": None,
+             "p90_hours": None, "p99_hours": None, "sla_breach_rate": None}
+    result = {"group_by": group_by, "sla_hours": sla_hours, "overall": empty, "groups": []}
+    if student_ids is not None and not student_ids:
+        return result
+
+    rows = _run(conn, f"""
+        SELECT {RESOLUTION_GROUPS[group_by]},
+               GREATEST(EXTRACT(EPOCH FROM resolved_at - created_at), 0)
+        FROM faults
+        {_where(student_ids, "status = 'Closed'", "resolved_at >= :start", "resolved_at < :end",
+                "created_at IS NOT NULL")}
+    """, student_ids, start=start, end=end)
+    if not rows:
+        return result
+
+    keys, seconds = zip(*rows)
+    seconds = np.asarray(seconds, dtype=float)
+    sla_seconds = sla_hours * 3600.0
+
+    overall = _duration_summary(np.zeros(len(seconds), dtype=np.int64), seconds, 1, sla_seconds)
+    result["overall"] = _summary_row(overall, 0)
+
+    # Label the distinct keys only, then regroup by label (several lockers map
+    # to one lock type, several students to one school).
+    unique_keys, key_codes = np.unique(np.asarray(keys, dtype=object).astype(str), return_inverse=True)
+    label_of = _group_labeler(group_by, unique_keys.tolist())
+    labels, label_codes = np.unique(
+        np.asarray([str(label_of(k)) for k in unique_keys], dtype=object).astype(str), return_inverse=True
+    )
+    codes = label_codes[key_codes]
+
+    summary = _duration_summary(codes, seconds, len(labels), sla_seconds)
+    groups = [{"label": str(label), **_summary_row(summary, i)} for i, label in enumerate(labels)]
+    groups.sort(key=lambda g: (-g["count"], g["label"]))
+    result["groups"] = groups
+    return result
+
+
+def get_resolution_stats(engine, start: datetime, end: datetime, group_by: str,
+                         school: Optional[str] = None,
+                         sla_hours: float = RESOLUTION_SLA_HOURS) -> dict:
+    """resolution_stats() for a school name (or all schools), on its own connection."""
+    student_ids = adon_db.get_student_ids_by_school().get(school, []) if school else None
+    with engine.connect() as conn:
+        return resolution_stats(conn, start, end, group_by, student_ids, sla_hours)
+
+
+# ============================================================================
+# Trends (time-bucketed counts)
+# ============================================================================
+
+TREND_GRANULARITIES = ("hour", "day", "week", "month")
+TREND_BREAKDOWNS = {
+    "status": "status",
+    "fault_type": "fault_type",
+    "school": "student_id_ext",  # folded into schools in Python, per aggregate row
+}
+TREND_MAX_BUCKETS = 2000
+
+
+_TREND_STEPS = {"hour": timedelta(hours=1), "day": timedelta(days=1), "week": timedelta(weeks=1)}
+
+
+def _first_bucket(start: datetime, granularity: str) -> datetime:
+    if granularity == "month":
+        return start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "week":  # date_trunc('week') starts on Monday
+        return (start - timedelta(days=start.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return start.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start.replace(minute=0, second=0, microsecond=0)
+
+
+def bucket_count(start: datetime, end: datetime, granularity: str) -> int:
+    """len(bucket_starts(...)), computed without building the buckets — check it first."""
+    first = _first_bucket(start, granularity)
+    if end <= first:
+        return 0
+    if granularity == "month":
+        last = end - timedelta(microseconds=1)
+        return (last.year * 12 + last.month) - (first.year * 12 + first.month) + 1
+    return -(-(end - first) // _TREND_STEPS[granularity])
+
+
+def bucket_starts(start: datetime, end: datetime, granularity: str) -> list[datetime]:
+    """Every date_trunc(granularity) bucket start overlapping [start, end), in order."""
+    current = _first_bucket(start, granularity)
+    buckets = []
+    while current < end:
+        buckets.append(current)
+        try:
+            if granularity == "month":
+                current = current.replace(year=current.year + current.month // 12, month=current.month % 12 + 1)
+            else:
+                current += _TREND_STEPS[granularity]
+        except (OverflowError, ValueError):  # the last bucket of year 9999
+            break
+    return buckets
+
+
+def fault_trends(conn, start: datetime, end: datetime, granularity: str,
+                 breakdown: Optional[str] = None, student_ids: Optional[list] = None) -> dict:
+    """
+    Faults opened per bucket in [start, end), as dense zero-filled series.
+
+    One aggregate over the created_at index: date_trunc in SQL, grouped by
+    bucket (and the breakdown column). Returns {"buckets": [iso...],
+    "series": [{"label", "counts": [...]}, ...]} — one "total" series without
+    a breakdown, else one per value, largest first.
+    """
+    buckets = bucket_starts(start, end, granularity)
+    result = {"buckets": [b.isoformat() for b in buckets], "series": []}
+    if not breakdown:
+        result["series"] = [{"label": "total", "counts": [0] * len(buckets)}]
+    if student_ids is not None and not student_ids:
+        return result
+
+    key_sql = TREND_BREAKDOWNS[breakdown] if breakdown else "NULL"
+    rows = _run(conn, f"""
+        SELECT date_trunc('{granularity}', created_at) AS bucket, {key_sql} AS key, COUNT(*)
+        FROM faults {_where(student_ids, "created_at >= :start", "created_at < :end")}
+        GROUP BY 1, 2
+    """, student_ids, start=start, end=end)
+
+    label_of = (lambda k: k)
+    if breakdown == "school":
+        students = adon_db.get_students_by_id()
+        label_of = lambda k: (students.get(k) or {}).get("school_name") or UNKNOWN_SCHOOL
+
+    index = {b: i for i, b in enumerate(buckets)}
+    series: dict = {}
+    for bucket, key, n in rows:
+        i = index.get(bucket.replace(tzinfo=None))
+        if i is None:
+            continue
+        label = "total" if not breakdown else (str(label_of(key)) if key is not None else "ללא")
+        series.setdefault(label, [0] * len(buckets))[i] += int(n)
+
+    if breakdown:
+        result["series"] = [
+            {"label": label, "counts": counts}
+            for label, counts in sorted(series.items(), key=lambda kv: -sum(kv[1]))
+        ]
+    elif series:
+        result["series"] = [{"label": "total", "counts": series["total"]}]
+    return result
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["backfill"]:
+        sys.exit("usage: python analytics.py backfill")
+    engine = adon_db.get_our_engine()
+    ensure_schema(engine)
+    print(f"fault_daily_rollup: {backfill(engine)} rows")
@@ -6,25 +6,36 @@ instead authenticated with a static shared token in the `X-API-Key` header
 (env var BOT_API_KEY). The bot is a separate server that cannot log in with
 Google, so it needs this separate surface.
 
-Two routes:
-  POST /api/bot/fault         — open a fault from the bot (same flow as the form)
-  GET  /api/bot/fault-status  — censored status for the customer (NO codes)
+Routes:
+  POST /api/bot/fault               — open a fault from the bot (same flow as the form);
+                                      send an Idempotency-Key header to make retries safe
+  POST /api/bot/fault/batch         — the same for a list of payloads, one transaction
+  GET  /api/bot/fault-status        — censored status for the customer (NO codes)
+  POST /api/bot/fault-status/batch  — the same for a list of phone/name queries
 
 The outbound direction (faults system -> bot, "fault resolved" WhatsApp) lives in
 flask_app.py (/api/faults/notify-resolved), because it runs behind the OAuth UI.
 
-Shared pieces (Fault model, session, helpers) are injected by flask_app via
+Shared pieces (Fault / IdempotencyKey models, session, helpers) are injected by flask_app via
 init_bot_api() to avoid a circular import.
 """
 
+import hashlib
+import json
+import logging
+import math
 import os
 import re
+import sqlite3
 from datetime import datetime, timedelta
 from functools import wraps
 
 from flask import Blueprint, jsonify, request
+from sqlalchemy.exc import IntegrityError
 
+import analytics
 import db as adon_db
+import shared_state
 
 bot_bp = Blueprint("bot_api", __name__)
 
@@ -41,6 +52,36 @@ ALLOWED_FAULT_TYPES = {
 # How far back a Closed fault still counts as "recently resolved" for status.
 _RESOLVED_WINDOW_DAYS = 14
 
+logger = logging.getLogger(__name__)
+
+
+def _limit_from_env(name, default, cast, minimum):
+    """Read one limiter setting; a bad value logs a warning and keeps the default."""
+    raw = os.environ.get(name)
+    if raw is None:
+        return default
+    try:
+        value = cast(raw)
+    except ValueError:
+        value = None
+    if value is None or not math.isfinite(value) or value < minimum:
+        logger.warning("%s=%r is not a number >= %s, using %s", name, raw, minimum, default)
+        return default
+    return value
+
+
+# /api/bot/* limiter (see require_bot_token). The in-flight cap defaults above
+# the two gunicorn workers, so overlapping bot calls are throttled by the bucket
+# rather than refused.
+_BOT_RATE_PER_SECOND = _limit_from_env("BOT_RATE_PER_SECOND", 5.0, float, 0.01)
+_BOT_RATE_BURST = _limit_from_env("BOT_RATE_BURST", 20.0, float, 1)
+_BOT_MAX_CONCURRENT = _limit_from_env("BOT_MAX_CONCURRENT", 4, int, 1)
+_limiter_warned = False
+
+# How long a successful create is replayed for the same Idempotency-Key.
+_IDEMPOTENCY_TTL = timedelta(hours=float(os.environ.get("BOT_IDEMPOTENCY_TTL_HOURS", "24")))
+_IDEMPOTENCY_KEY_MAX_LEN = 255
+
 # Injected by flask_app.init_bot_api() — set once at startup.
 _deps: dict = {}
 
@@ -63,17 +104,133 @@ def _token_ok(provided: str, expected: str) -> bool:
     return hmac.compare_digest(str(provided), str(expected))
 
 
+def _limited(error: str, retry_after: float, status: int):
+    response = jsonify({"ok": False, "error": error})
+    response.status_code = status
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
 def require_bot_token(view):
+    """
+    X-API-Key auth, then the bot limiter: a token bucket per key
+    (BOT_RATE_PER_SECOND, bursts of BOT_RATE_BURST) and at most
+    BOT_MAX_CONCURRENT requests in flight, shared by all workers through
+    shared_state. Rejections carry Retry-After.
+    If the shared state can't be reached, requests are let through.
+    """
     @wraps(view)
     def wrapped(*args, **kwargs):
         expected = os.environ.get("BOT_API_KEY", "")
         provided = request.headers.get("X-API-Key", "")
         if not _token_ok(provided, expected):
             return jsonify({"ok": False, "error": "unauthorized"}), 401
-        return view(*args, **kwargs)
+
+        bucket = "bot:" + hashlib.sha256(provided.encode()).hexdigest()[:16]
+        try:
+            ticket, retry_after, reason = shared_state.admit(
+                bucket, _BOT_RATE_PER_SECOND, _BOT_RATE_BURST, _BOT_MAX_CONCURRENT,
+            )
+        except (sqlite3.Error, OSError) as e:
+            global _limiter_warned
+            if not _limiter_warned:
+                logger.warning("rate limiter unavailable, letting requests through: %s", e)
+                _limiter_warned = True
+            return view(*args, **kwargs)
+        if ticket is None:
+            if reason == "concurrency":
+                return _limited("too_many_concurrent_requests", retry_after, 503)
+            return _limited("rate_limited", retry_after, 429)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            try:
+                shared_state.release(ticket)
+            except (sqlite3.Error, OSError):
+                pass  # the entry goes stale and stops counting on its own
     return wrapped
 
 
+# ---------------------------------------------------------------------------
+# Idempotency (POST /api/bot/fault)
+#
+# The bot retries on timeout. With an Idempotency-Key header, a successful
+# create stores its response in bot_idempotency_keys in the SAME transaction
+# as the fault, so a retry gets the stored response back without resolving
+# or inserting again, and two racing retries can't both commit a fault (the
+# loser hits the primary key, rolls back, and replays the winner). Only
+# successes are stored — for a batch, only one that created at least one
+# fault; a request that created nothing is cheap to re-run.
+# ---------------------------------------------------------------------------
+
+def _request_hash(data: dict) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def _idempotent_replay(session, key: str, request_hash: str):
+    """The stored response for a live `key`, a 422 if it was used for another request, else None."""
+    IdempotencyKey = _deps["IdempotencyKey"]
+    record = session.get(IdempotencyKey, key)
+    if record is None or record.created_at < datetime.utcnow() - _IDEMPOTENCY_TTL:
+        return None
+    if record.request_hash != request_hash:
+        return jsonify({"ok": False, "error": "idempotency_key_reused"}), 422
+    response = jsonify(json.loads(record.response))
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _idempotency_check(data: dict):
+    """(key, request hash, early response) for this request's Idempotency-Key header.
+
+    The early response is a replay / 422 / 400 to return as-is, or None to go ahead.
+    """
+    key = (request.headers.get("Idempotency-Key") or "").strip() or None
+    if key is None:
+        return None, None, None
+    if len(key) > _IDEMPOTENCY_KEY_MAX_LEN:
+        return key, None, (jsonify({"ok": False, "error": "Idempotency-Key ארוך מדי"}), 400)
+    request_hash = _request_hash(data)
+    session = _deps["OurSession"]()
+    try:
+        return key, request_hash, _idempotent_replay(session, key, request_hash)
+    finally:
+        session.close()
+
+
+def _commit_idempotent(session, key, request_hash, body: dict):
+    """Commit the session, storing `body` under `key` if given. Returns the winner's
+    stored response if a concurrent retry with the same key committed first, else None."""
+    if key:
+        _remember_response(session, key, request_hash, body)
+    try:
+        session.commit()
+    except IntegrityError:
+        # A concurrent retry with the same key committed first; ours is rolled back.
+        session.rollback()
+        if key:
+            replay = _idempotent_replay(session, key, request_hash)
+            if replay is not None:
+                return replay
+        raise
+    return None
+
+
+def _remember_response(session, key: str, request_hash: str, body: dict) -> None:
+    """Stage `body` under `key` in the caller's transaction, dropping expired keys."""
+    IdempotencyKey = _deps["IdempotencyKey"]
+    now = datetime.utcnow()
+    session.query(IdempotencyKey).filter(
+        IdempotencyKey.created_at < now - _IDEMPOTENCY_TTL
+    ).delete(synchronize_session=False)
+    session.add(IdempotencyKey(
+        key=key,
+        request_hash=request_hash,
+        response=json.dumps(body, ensure_ascii=False),
+        created_at=now,
+    ))
+
+
 # ---------------------------------------------------------------------------
 # Student / locker resolution helpers
 # ---------------------------------------------------------------------------
@@ -96,16 +253,6 @@ def _norm_phone(phone) -> str:
     return digits
 
 
-def _find_students_by_phone(phone) -> list[dict]:
-    target = _norm_phone(phone)
-    if not target:
-        return []
-    return [
-        s for s in adon_db.get_all_students()
-        if _norm_phone(s.get("parentPhone")) == target
-    ]
-
-
 def _full_name(student: dict) -> str:
     return f"{student.get('fname') or ''} {student.get('lname') or ''}".strip()
 
@@ -119,20 +266,72 @@ def _norm_name(name) -> str:
     return s.lower()
 
 
-def _name_matches(query, full_name) -> bool:
-    """Flexible match: exact, substring either way, or all query tokens present.
+def _students_by_phone() -> dict[str, dict]:
+    """
+    {normalized parent phone: family}, rebuilt once per students-cache refresh.
+
+    A family is the phone's students (roster order) with their normalized
+    names and a token -> positions index, so matching a sibling's name does
+    no per-request normalisation of the candidates.
+    """
+    def build(students):
+        index: dict[str, dict] = {}
+        for s in students:
+            phone = _norm_phone(s.get("parentPhone"))
+            if not phone:
+                continue
+            family = index.setdefault(phone, {"students": [], "names": [], "tokens": {}})
+            name = _norm_name(_full_name(s))
+            for token in set(name.split()):
+                family["tokens"].setdefault(token, set()).add(len(family["students"]))
+            family["students"].append(s)
+            family["names"].append(name)
+        return index
+    return adon_db.derived_student_index("bot_by_phone", build)
+
+
+# Name-match ranks, best first.
+_EXACT, _ALL_TOKENS, _SUBSTRING = 3, 2, 1
+
+
+def _rank_names(family: dict, query) -> list[int]:
+    """Score of `query` against each sibling: exact > all query tokens > substring either way > 0.
 
     Lets a customer type just a first name, the full name, or with minor spacing
-    differences and still resolve to the right sibling on a shared parent phone.
+    differences, and prefers the closest sibling over ones that merely contain it
+    ("דן" picks דן over דנה).
     """
     q = _norm_name(query)
-    n = _norm_name(full_name)
-    if not q or not n:
-        return False
-    if q == n or q in n or n in q:
-        return True
-    n_tokens = set(n.split())
-    return all(t in n_tokens for t in q.split())
+    scores = [0] * len(family["names"])
+    if not q:
+        return scores
+    hits = None
+    for token in set(q.split()):
+        positions = family["tokens"].get(token, set())
+        hits = positions if hits is None else hits & positions
+    for i in hits or ():
+        scores[i] = _ALL_TOKENS
+    for i, name in enumerate(family["names"]):
+        if name == q:
+            scores[i] = _EXACT
+        elif not scores[i] and name and (q in name or name in q):
+            scores[i] = _SUBSTRING
+    return scores
+
+
+def _find_students_by_phone(phone, name=None) -> list[dict]:
+    """Students on this parent phone. With `name`, only the best-ranked name
+    matches — unless the name matches none of them, then all of them."""
+    family = _students_by_phone().get(_norm_phone(phone))
+    if family is None:
+        return []
+    students = family["students"]
+    if name:
+        scores = _rank_names(family, name)
+        best = max(scores, default=0)
+        if best:
+            students = [s for s, score in zip(students, scores) if score == best]
+    return list(students)
 
 
 def _match_summary(students: list[dict]) -> list[dict]:
@@ -151,22 +350,35 @@ def _match_summary(students: list[dict]) -> list[dict]:
 # POST /api/bot/fault — open a fault from the bot
 # ---------------------------------------------------------------------------
 
-@bot_bp.route("/api/bot/fault", methods=["POST"])
-@require_bot_token
-def bot_create_fault():
-    data = request.get_json(silent=True) or {}
+# Most payloads / phone queries accepted by one batch request.
+_BATCH_MAX_ITEMS = 100
+
+# Free-text payload fields; anything else (a number, a list) is a 400, not a 500.
+_TEXT_FIELDS = ("parent_phone", "student_name", "locker_id", "description")
+
+
+def _resolve_fault_payload(data: dict, resolve_locker: bool = True):
+    """
+    Validate a create payload and resolve its student and locker.
+    Returns (Fault fields, None), or (None, (error body, HTTP status)).
+    With resolve_locker=False a payload without a locker_id is left with
+    locker_id None, for the caller to look up in bulk.
+    """
+    for name in _TEXT_FIELDS:
+        if data.get(name) is not None and not isinstance(data[name], str):
+            return None, ({"ok": False, "error": f"{name} חייב להיות מחרוזת"}, 400)
 
     parent_phone = (data.get("parent_phone") or "").strip()
     if not parent_phone:
-        return jsonify({"ok": False, "error": "parent_phone חובה"}), 400
+        return None, ({"ok": False, "error": "parent_phone חובה"}, 400)
 
     fault_type = data.get("fault_type")
     if fault_type not in ALLOWED_FAULT_TYPES:
-        return jsonify({
+        return None, ({
             "ok": False,
             "error": "fault_type לא חוקי",
             "allowed": sorted(ALLOWED_FAULT_TYPES),
-        }), 400
+        }, 400)
 
     student_name = (data.get("student_name") or "").strip() or None
     locker_id = (data.get("locker_id") or "").strip() or None
@@ -180,73 +392,182 @@ def bot_create_fault():
             student = adon_db.get_student_by_id(locker["current_student_id"])
 
     if student is None:
-        matches = _find_students_by_phone(parent_phone)
-        if student_name:
-            named = [s for s in matches if _name_matches(student_name, _full_name(s))]
-            if named:  # only narrow when the name actually matched someone
-                matches = named
+        # Narrowed to the best name match, only when the name matched someone.
+        matches = _find_students_by_phone(parent_phone, student_name)
         if len(matches) == 0:
-            return jsonify({"ok": False, "error": "student_not_found"}), 404
+            return None, ({"ok": False, "error": "student_not_found"}, 404)
         if len(matches) > 1:
             # Several kids on this phone and the name didn't single one out.
-            return jsonify({
+            return None, ({
                 "ok": False,
                 "error": "multiple_matches",
                 "matches": _match_summary(matches),
-            }), 409
+            }, 409)
         student = matches[0]
 
     student_id_ext = student["id"]
 
     # --- Resolve the locker if the bot didn't hand us one ---
-    if not locker_id:
+    if not locker_id and resolve_locker:
         locker = adon_db.get_locker_by_student_id(student_id_ext)
         locker_id = locker["locker_id"] if locker else None
 
-    # --- Create the fault exactly like the form does ---
+    return {
+        "student_id_ext": student_id_ext,
+        "locker_id": locker_id,
+        "fault_type": fault_type,
+        "books_stuck": bool(data.get("books_stuck", False)),
+        "description": data.get("description"),
+    }, None
+
+
+def _new_fault(fields: dict, is_recurring: bool):
     # A bot fault must behave identically to a form fault; it just enters from a
     # different place. The form derives severity from fault_type and does NOT
     # assign a technician on creation (that happens later in the scheduling
     # screen) — so neither do we. assigned_technician stays null here.
+    return _deps["Fault"](
+        **fields,
+        severity=_deps["get_severity"](fields["fault_type"]),
+        is_urgent=fields["books_stuck"],
+        is_recurring=is_recurring,
+        status="Open",
+    )
+
+
+def _created_body(fault) -> dict:
+    return {
+        "ok": True,
+        "fault_id": fault.id,
+        "status": fault.status,
+        "is_recurring": fault.is_recurring,
+        "assigned_technician": fault.assigned_technician,
+    }
+
+
+@bot_bp.route("/api/bot/fault", methods=["POST"])
+@require_bot_token
+def bot_create_fault():
+    data = request.get_json(silent=True) or {}
+
+    idempotency_key, request_hash, early = _idempotency_check(data)
+    if early is not None:
+        return early
+
+    fields, error = _resolve_fault_payload(data)
+    if error:
+        return jsonify(error[0]), error[1]
+
     Fault = _deps["Fault"]
     OurSession = _deps["OurSession"]
-    get_severity = _deps["get_severity"]
 
     session = OurSession()
     try:
-        severity = get_severity(fault_type)  # derived from fault_type, like the form
-        books_stuck = bool(data.get("books_stuck", False))
-        is_urgent = books_stuck
-
-        previous = session.query(Fault).filter(
-            Fault.student_id_ext == student_id_ext,
-            Fault.fault_type == fault_type,
+        previous = session.query(Fault.id).filter(
+            Fault.student_id_ext == fields["student_id_ext"],
+            Fault.fault_type == fields["fault_type"],
             Fault.status == "Closed",
         ).first()
-        is_recurring = previous is not None
-
-        new_fault = Fault(
-            student_id_ext=student_id_ext,
-            locker_id=locker_id,
-            fault_type=fault_type,
-            severity=severity,
-            books_stuck=books_stuck,
-            is_urgent=is_urgent,
-            is_recurring=is_recurring,
-            status="Open",
-            description=data.get("description"),
-        )
+        new_fault = _new_fault(fields, is_recurring=previous is not None)
         session.add(new_fault)
-        session.commit()
-        session.refresh(new_fault)
-
-        return jsonify({
-            "ok": True,
-            "fault_id": new_fault.id,
-            "status": new_fault.status,
-            "is_recurring": is_recurring,
-            "assigned_technician": new_fault.assigned_technician,
-        })
+        session.flush()
+        analytics.record_opened(session.connection(), new_fault)
+
+        body = _created_body(new_fault)
+        replay = _commit_idempotent(session, idempotency_key, request_hash, body)
+        if replay is not None:
+            return replay
+        _deps["on_faults_changed"]()
+        # Like the form: burst alerts this fault raised (not part of an idempotent replay).
+        return jsonify({**body, "hotspots": _deps["on_fault_created"](new_fault)})
+    except Exception as e:  # noqa: BLE001 — surface the reason to the bot
+        session.rollback()
+        return jsonify({"ok": False, "error": str(e)}), 500
+    finally:
+        session.close()
+
+
+@bot_bp.route("/api/bot/fault/batch", methods=["POST"])
+@require_bot_token
+def bot_create_faults_batch():
+    """
+    {"faults": [<POST /api/bot/fault payload>, ...]} -> {"ok": true, "results": [...]}.
+
+    One result per payload, in order: the single route's body (with the
+    "hotspots" alerts each created fault raised), with "http_status" added
+    on errors. Adon lookups are batched — the given
+    locker_ids are fetched up front and the lockers of students resolved by
+    phone in one query. Valid payloads are created together in one
+    transaction — one recurring-check query and one multi-row INSERT.
+    Idempotency-Key applies to the whole batch, and is only stored once at
+    least one fault was created.
+    """
+    data = request.get_json(silent=True) or {}
+    payloads = data.get("faults")
+    if not isinstance(payloads, list) or not payloads:
+        return jsonify({"ok": False, "error": "faults חייב להיות רשימה לא ריקה"}), 400
+    if len(payloads) > _BATCH_MAX_ITEMS:
+        return jsonify({"ok": False, "error": f"עד {_BATCH_MAX_ITEMS} תקלות בבקשה"}), 400
+
+    idempotency_key, request_hash, early = _idempotency_check(data)
+    if early is not None:
+        return early
+
+    # Warm the per-locker cache so resolving each payload doesn't query Adon.
+    adon_db.get_lockers_by_ids(
+        p["locker_id"].strip() for p in payloads
+        if isinstance(p, dict) and isinstance(p.get("locker_id"), str)
+    )
+    results: list = [None] * len(payloads)
+    prepared = []
+    for i, payload in enumerate(payloads):
+        fields, error = _resolve_fault_payload(payload if isinstance(payload, dict) else {},
+                                               resolve_locker=False)
+        if error:
+            results[i] = {**error[0], "http_status": error[1]}
+        else:
+            prepared.append((i, fields))
+    lockers = adon_db.get_lockers_by_student_ids(
+        fields["student_id_ext"] for _, fields in prepared if not fields["locker_id"]
+    )
+    for _, fields in prepared:
+        if not fields["locker_id"]:
+            fields["locker_id"] = (lockers.get(fields["student_id_ext"]) or {}).get("locker_id")
+
+    Fault = _deps["Fault"]
+    OurSession = _deps["OurSession"]
+
+    session = OurSession()
+    try:
+        new_faults = []
+        if prepared:
+            previous = set(session.query(Fault.student_id_ext, Fault.fault_type).filter(
+                Fault.student_id_ext.in_({fields["student_id_ext"] for _, fields in prepared}),
+                Fault.status == "Closed",
+            ).distinct().all())
+            new_faults = [
+                _new_fault(fields, is_recurring=(fields["student_id_ext"], fields["fault_type"]) in previous)
+                for _, fields in prepared
+            ]
+            session.add_all(new_faults)
+            session.flush()  # one INSERT ... VALUES (...), (...) RETURNING id
+            analytics.record_opened_many(session.connection(), new_faults)
+            for (i, _), fault in zip(prepared, new_faults):
+                results[i] = _created_body(fault)
+
+        body = {"ok": True, "results": results}
+        # A batch where every item failed created nothing, so there is nothing to
+        # replay; a retry (maybe with fixed lookups) runs again.
+        replay = _commit_idempotent(session, idempotency_key if new_faults else None,
+                                    request_hash, body)
+        if replay is not None:
+            return replay
+        if new_faults:
+            _deps["on_faults_changed"]()
+            for (i, _), fault in zip(prepared, new_faults):
+                results[i] = {**results[i], "hotspots": _deps["on_fault_created"](fault)}
+
+        return jsonify(body)
     except Exception as e:  # noqa: BLE001 — surface the reason to the bot
         session.rollback()
         return jsonify({"ok": False, "error": str(e)}), 500
@@ -258,6 +579,19 @@ def bot_create_fault():
 # GET /api/bot/fault-status — censored status for the customer (NO codes)
 # ---------------------------------------------------------------------------
 
+_STATUS_NOT_FOUND = {"found": False, "message": "לא נמצאה תקלה רשומה על המספר הזה."}
+_STATUS_OPEN = {
+    "found": True,
+    "status": "open",
+    "message": "התקלה שלך רשומה במערכת. טכנאי יגיע בימים הקרובים לטפל בה.",
+}
+_STATUS_RESOLVED = {
+    "found": True,
+    "status": "resolved",
+    "message": "התקלה שדיווחת עליה טופלה. תודה על הסבלנות 🙏",
+}
+
+
 @bot_bp.route("/api/bot/fault-status", methods=["GET"])
 @require_bot_token
 def bot_fault_status():
@@ -267,44 +601,87 @@ def bot_fault_status():
     if not phone:
         return jsonify({"ok": False, "error": "phone נדרש"}), 400
 
-    students = _find_students_by_phone(phone)
-    if name and len(students) > 1:
-        named = [s for s in students if _name_matches(name, _full_name(s))]
-        if named:
-            students = named
+    students = _find_students_by_phone(phone, name)
     student_ids = [s["id"] for s in students]
 
-    not_found = {"found": False, "message": "לא נמצאה תקלה רשומה על המספר הזה."}
     if not student_ids:
-        return jsonify(not_found)
+        return jsonify(_STATUS_NOT_FOUND)
 
     Fault = _deps["Fault"]
     OurSession = _deps["OurSession"]
 
     session = OurSession()
     try:
-        faults = session.query(Fault).filter(
-            Fault.student_id_ext.in_(student_ids)
-        ).all()
-
-        if any(f.status == "Open" for f in faults):
-            return jsonify({
-                "found": True,
-                "status": "open",
-                "message": "התקלה שלך רשומה במערכת. טכנאי יגיע בימים הקרובים לטפל בה.",
-            })
+        # Two EXISTS probes on ix_faults_student_status_resolved — neither
+        # reads the family's fault history.
+        family_faults = session.query(Fault.id).filter(Fault.student_id_ext.in_(student_ids))
+        has_open = session.query(
+            family_faults.filter(Fault.status == "Open").exists()
+        ).scalar()
+        if has_open:
+            return jsonify(_STATUS_OPEN)
 
         cutoff = datetime.utcnow() - timedelta(days=_RESOLVED_WINDOW_DAYS)
-        if any(
-            f.status == "Closed" and f.resolved_at and f.resolved_at >= cutoff
-            for f in faults
-        ):
-            return jsonify({
-                "found": True,
-                "status": "resolved",
-                "message": "התקלה שדיווחת עליה טופלה. תודה על הסבלנות 🙏",
-            })
-
-        return jsonify(not_found)
+        resolved_recently = session.query(
+            family_faults.filter(Fault.status == "Closed", Fault.resolved_at >= cutoff).exists()
+        ).scalar()
+        if resolved_recently:
+            return jsonify(_STATUS_RESOLVED)
+
+        return jsonify(_STATUS_NOT_FOUND)
     finally:
         session.close()
+
+
+@bot_bp.route("/api/bot/fault-status/batch", methods=["POST"])
+@require_bot_token
+def bot_fault_status_batch():
+    """
+    {"queries": [{"phone": ..., "name": ...}, ...]} -> {"ok": true, "results": [...]}.
+
+    One result per query, in order, each exactly what GET /api/bot/fault-status
+    would answer ("http_status" added on errors). All families are answered
+    by a single IN query that only touches open and recently-closed faults.
+    """
+    data = request.get_json(silent=True) or {}
+    queries = data.get("queries")
+    if not isinstance(queries, list) or not queries:
+        return jsonify({"ok": False, "error": "queries חייב להיות רשימה לא ריקה"}), 400
+    if len(queries) > _BATCH_MAX_ITEMS:
+        return jsonify({"ok": False, "error": f"עד {_BATCH_MAX_ITEMS} שאילתות בבקשה"}), 400
+
+    families: list = []
+    for query in queries:
+        query = query if isinstance(query, dict) else {}
+        if not query.get("phone"):
+            families.append(None)
+        else:
+            families.append([s["id"] for s in _find_students_by_phone(query["phone"], query.get("name"))])
+
+    all_ids = {student_id for family in families if family for student_id in family}
+    open_ids, resolved_ids = set(), set()
+    if all_ids:
+        Fault = _deps["Fault"]
+        cutoff = datetime.utcnow() - timedelta(days=_RESOLVED_WINDOW_DAYS)
+        session = _deps["OurSession"]()
+        try:
+            rows = session.query(Fault.student_id_ext, Fault.status).filter(
+                Fault.student_id_ext.in_(all_ids),
+                (Fault.status == "Open") | ((Fault.status == "Closed") & (Fault.resolved_at >= cutoff)),
+            ).distinct().all()
+        finally:
+            session.close()
+        for student_id, status in rows:
+            (open_ids if status == "Open" else resolved_ids).add(student_id)
+
+    results = []
+    for family in families:
+        if family is None:
+            results.append({"ok": False, "error": "phone נדרש", "http_status": 400})
+        elif open_ids.intersection(family):
+            results.append(_STATUS_OPEN)
+        elif resolved_ids.intersection(family):
+            results.append(_STATUS_RESOLVED)
+        else:
+            results.append(_STATUS_NOT_FOUND)
+    return jsonify({"ok": True, "results": results})
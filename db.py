@@ -88,6 +88,25 @@ def invalidate_cache():
     """Clear the in-memory cache (useful for tests or admin actions)."""
     with _cache_lock:
         _cache.clear()
+        _student_indexes.clear()
+
+
+# Lookup structures derived from the cached students list. Each one is tied to
+# the exact list object it was built from, so it's rebuilt once per refresh.
+_student_indexes: dict = {}
+
+
+def derived_student_index(key: str, build):
+    """Return build(students) for the current students list, built once per cache refresh."""
+    students = get_all_students()
+    with _cache_lock:
+        entry = _student_indexes.get(key)
+        if entry is not None and entry[0] is students:
+            return entry[1]
+    index = build(students)
+    with _cache_lock:
+        _student_indexes[key] = (students, index)
+    return index
 
 
 # ---------------------------------------------------------------------------
@@ -203,14 +222,98 @@ def get_locker_by_student_id(student_id: str) -> Optional[dict]:
     return locker
 
 
+_LOCKERS_BY_IDS_SQL = text(_LOCKER_BASE_SQL + ' WHERE l.id = ANY(:locker_ids)')
+
+_LOCKER_BATCH_SIZE = 500
+
+
+def get_lockers_by_ids(locker_ids) -> dict[str, dict]:
+    """
+    {locker_id: locker} for the given ids (unknown ids are simply absent).
+
+    Shares the per-locker cache with get_locker_by_id(); only the misses are
+    fetched, in batched `= ANY(:ids)` queries, so bulk enrichment costs scale
+    with the faults being shown, not with the whole Adon locker fleet.
+    """
+    found: dict[str, dict] = {}
+    missing = []
+    for locker_id in {i for i in locker_ids if i}:
+        cached = _cache_get(f"locker_id:{locker_id}")
+        if cached is None:
+            missing.append(locker_id)
+        elif cached:
+            found[locker_id] = cached
+
+    for start in range(0, len(missing), _LOCKER_BATCH_SIZE):
+        batch = missing[start:start + _LOCKER_BATCH_SIZE]
+        with get_adon_engine().connect() as conn:
+            rows = conn.execute(_LOCKERS_BY_IDS_SQL, {"locker_ids": batch}).fetchall()
+        fetched = {r.locker_id: _row_to_dict(r) for r in rows}
+        for locker_id in batch:
+            _cache_set(f"locker_id:{locker_id}", fetched.get(locker_id, {}))
+        found.update(fetched)
+    return found
+
+
+# Newest first per student, so the first row seen for a student is the one
+# get_locker_by_student_id() would return.
+_LOCKERS_BY_STUDENT_IDS_SQL = text(
+    _LOCKER_BASE_SQL
+    + ' WHERE l."studentId" = ANY(:student_ids) ORDER BY l."studentId", l."updatedAt" DESC'
+)
+
+
+def get_lockers_by_student_ids(student_ids) -> dict[str, dict]:
+    """
+    {student_id: locker} for the given students (students without a locker
+    are absent). Batched like get_lockers_by_ids(), sharing the per-student
+    cache with get_locker_by_student_id() and filling the per-locker one.
+    """
+    found: dict[str, dict] = {}
+    missing = []
+    for student_id in {i for i in student_ids if i}:
+        cached = _cache_get(f"locker_student:{student_id}")
+        if cached is None:
+            missing.append(student_id)
+        elif cached:
+            found[student_id] = cached
+
+    for start in range(0, len(missing), _LOCKER_BATCH_SIZE):
+        batch = missing[start:start + _LOCKER_BATCH_SIZE]
+        with get_adon_engine().connect() as conn:
+            rows = conn.execute(_LOCKERS_BY_STUDENT_IDS_SQL, {"student_ids": batch}).fetchall()
+        fetched: dict[str, dict] = {}
+        for r in rows:
+            fetched.setdefault(r.current_student_id, _row_to_dict(r))
+        for student_id in batch:
+            _cache_set(f"locker_student:{student_id}", fetched.get(student_id, {}))
+        for locker in fetched.values():
+            _cache_set(f"locker_id:{locker['locker_id']}", locker)
+        found.update(fetched)
+    return found
+
+
+def get_students_by_id() -> dict[str, dict]:
+    """{student.id: student} over the cached students list."""
+    return derived_student_index("by_id", lambda students: {s["id"]: s for s in students})
+
+
+def get_student_ids_by_school() -> dict[str, list[str]]:
+    """{school_name: [student.id, ...]} over the cached students list."""
+    def build(students):
+        index: dict[str, list[str]] = {}
+        for s in students:
+            if s.get("school_name"):
+                index.setdefault(s["school_name"], []).append(s["id"])
+        return index
+    return derived_student_index("ids_by_school", build)
+
+
 def get_student_by_id(student_id: str) -> Optional[dict]:
     """Quick lookup of a single student from the cached students list."""
     if not student_id:
         return None
-    for s in get_all_students():
-        if s["id"] == student_id:
-            return s
-    return None
+    return get_students_by_id().get(student_id)
 
 
 # ---------------------------------------------------------------------------
@@ -255,6 +358,13 @@ def get_school_regions() -> dict[str, str]:
     return result
 
 
+def get_region_for_student(student_id: Optional[str]) -> tuple[Optional[str], str]:
+    """(school_name, region) for a student id via the indexed lookups above."""
+    student = get_student_by_id(student_id) if student_id else None
+    school_name = (student or {}).get("school_name")
+    return school_name, get_region_for_school(school_name)
+
+
 def get_region_for_school(school_name: Optional[str]) -> str:
     """Convenience: region for a single school name, 'Unknown' if not found."""
     if not school_name:
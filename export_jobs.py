@@ -0,0 +1,299 @@
+"""
+Background export jobs.
+
+A request only enqueues the job and returns its id; a separate runner
+process builds the file under EXPORT_JOBS_DIR (the shared /app/data volume),
+and the UI polls the status until it can download the artifact. The build
+never runs inside a gunicorn worker, so a full-history export neither holds
+one of our two workers nor competes for its GIL.
+
+Each job is files in EXPORT_JOBS_DIR, which is also the queue:
+    <job_id>.json         status (rewritten atomically, readable by every worker)
+    <job_id>.params.json  what to export, until the job has run
+    <job_id>.<format>     the artifact, once done
+
+One runner per volume (it holds an flock on .runner.lock) runs queued jobs
+one at a time, oldest first. The web workers start it on demand, detached,
+so it outlives worker restarts; a runner that starts finds jobs a dead one
+left running and queues them again (up to _MAX_ATTEMPTS). It can also run as
+its own service:
+    python export_jobs.py worker
+Artifacts and status files older than EXPORT_JOBS_RETENTION_HOURS are
+deleted on each new job. A job whose heartbeat stops is reported as failed.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+import db as adon_db
+import exports
+
+EXPORT_JOBS_DIR = Path(os.environ.get("EXPORT_JOBS_DIR", "/app/data/exports"))
+EXPORT_JOBS_RETENTION_HOURS = float(os.environ.get("EXPORT_JOBS_RETENTION_HOURS", "24"))
+
+FORMATS = exports.MIMETYPES
+
+# A running job rewrites its status at least once per chunk; silence this long
+# means the process that owned it is gone. Queued jobs may legitimately wait
+# behind a long export, so they get more slack.
+_STALE_AFTER_SECONDS = {"running": 600, "queued": 3600}
+
+_JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+_LOCK_NAME = ".runner.lock"
+_POLL_SECONDS = 1.0
+# A job that kills its runner (e.g. out of memory) isn't retried forever.
+_MAX_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------------------------
+# Status files
+# ---------------------------------------------------------------------------
+
+def _status_path(job_id: str) -> Path:
+    return EXPORT_JOBS_DIR / f"{job_id}.json"
+
+
+def _params_path(job_id: str) -> Path:
+    return EXPORT_JOBS_DIR / f"{job_id}.params.json"
+
+
+def artifact_path(job: dict) -> Path:
+    return EXPORT_JOBS_DIR / f"{job['id']}.{job['format']}"
+
+
+def _write_status(job: dict) -> None:
+    job["updated_at"] = time.time()
+    path = _status_path(job["id"])
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(job, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(path)
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    """Current status of a job, or None if unknown / expired."""
+    if not _JOB_ID_RE.match(job_id or ""):
+        return None
+    try:
+        job = json.loads(_status_path(job_id).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    stale_after = _STALE_AFTER_SECONDS.get(job["state"])
+    if stale_after is not None and time.time() - job["updated_at"] > stale_after:
+        job["state"] = "failed"
+        job["error"] = "העבודה הופסקה (השרת הופעל מחדש?)"
+    total = job.get("rows_total")
+    job["progress"] = 1.0 if job["state"] == "done" else (
+        round(job["rows_done"] / total, 3) if total else 0.0
+    )
+    return job
+
+
+def cleanup(max_age_hours: float = EXPORT_JOBS_RETENTION_HOURS) -> int:
+    """Delete status files and artifacts older than `max_age_hours`. Returns files removed."""
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for path in EXPORT_JOBS_DIR.glob("*"):
+        if path.name == _LOCK_NAME:
+            continue
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+# ---------------------------------------------------------------------------
+# Runner (its own process)
+# ---------------------------------------------------------------------------
+
+def _run(job: dict, engine, filters: dict) -> None:
+    job["state"] = "running"
+    job["attempts"] = job.get("attempts", 0) + 1
+    job["rows_done"] = 0
+    _write_status(job)
+    job["rows_total"] = exports.count_export_rows(engine, **filters)
+    _write_status(job)
+
+    def tracked(chunks):
+        for chunk in chunks:
+            yield chunk
+            job["rows_done"] += len(chunk)
+            _write_status(job)
+
+    path = artifact_path(job)
+    tmp = path.with_name(path.name + ".part")
+    chunks = tracked(exports.iter_export_chunks(engine, **filters))
+    try:
+        exports.WRITERS[job["format"]](chunks, str(tmp))
+        tmp.replace(path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+    job["state"] = "done"
+    job["size"] = path.stat().st_size
+    job["finished_at"] = datetime.utcnow().isoformat() + "Z"
+    _write_status(job)
+
+
+def _load_params(job_id: str) -> dict:
+    params = json.loads(_params_path(job_id).read_text(encoding="utf-8"))
+    return {
+        "start": datetime.fromisoformat(params["start"]) if params["start"] else None,
+        "end": datetime.fromisoformat(params["end"]) if params["end"] else None,
+        "student_ids": params["student_ids"],
+    }
+
+
+def _jobs(state: str) -> list[dict]:
+    """Stored jobs in `state`, oldest first."""
+    jobs = []
+    for path in EXPORT_JOBS_DIR.glob("*.json"):
+        if not _JOB_ID_RE.match(path.stem):
+            continue
+        try:
+            job = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        if job.get("state") == state:
+            jobs.append(job)
+    return sorted(jobs, key=lambda j: j["created_at"])
+
+
+def _requeue_interrupted() -> None:
+    # Only the lock holder runs jobs, so anything "running" lost its runner.
+    for job in _jobs("running"):
+        if job.get("attempts", 0) >= _MAX_ATTEMPTS:
+            job["state"] = "failed"
+            job["error"] = "הייצוא נקטע שוב ושוב"
+        else:
+            job["state"] = "queued"
+        _write_status(job)
+
+
+def _run_next(engine) -> bool:
+    """Run the oldest queued job. False if there was none."""
+    queued = _jobs("queued")
+    if not queued:
+        return False
+    job = queued[0]
+    try:
+        _run(job, engine, _load_params(job["id"]))
+    except Exception as e:
+        logger.exception("export job %s failed", job["id"])
+        job["state"] = "failed"
+        job["error"] = str(e)
+        _write_status(job)
+    _params_path(job["id"]).unlink(missing_ok=True)
+    return True
+
+
+def run_worker() -> None:
+    """Run queued jobs until killed. Returns at once if another runner is active."""
+    EXPORT_JOBS_DIR.mkdir(parents=True, exist_ok=True)
+    lock = open(EXPORT_JOBS_DIR / _LOCK_NAME, "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return
+    os.nice(10)  # interactive requests first when we share the CPUs
+    _requeue_interrupted()
+    engine = adon_db.get_our_engine()
+    while True:
+        if not _run_next(engine):
+            time.sleep(_POLL_SECONDS)
+
+
+def _runner_active() -> bool:
+    with open(EXPORT_JOBS_DIR / _LOCK_NAME, "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        return False
+
+
+def ensure_runner() -> None:
+    """Start a detached runner process unless one already holds the lock."""
+    EXPORT_JOBS_DIR.mkdir(parents=True, exist_ok=True)
+    if _runner_active():
+        return
+    # Two workers racing here is harmless: the loser can't take the lock and exits.
+    subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve()), "worker"],
+        stdin=subprocess.DEVNULL, start_new_session=True,
+    )
+
+
+def resume() -> None:
+    """On boot: restart the runner if jobs were left queued or running."""
+    if EXPORT_JOBS_DIR.is_dir() and (_jobs("queued") or _jobs("running")):
+        ensure_runner()
+
+
+def submit(fmt: str, from_day=None, to_day=None, school: Optional[str] = None,
+           student_ids: Optional[list] = None, requested_by: Optional[str] = None) -> dict:
+    """
+    Enqueue an export of faults created between `from_day` and `to_day`
+    (dates, inclusive, either optional), optionally for one school's
+    `student_ids`. Returns the new job's status.
+    """
+    EXPORT_JOBS_DIR.mkdir(parents=True, exist_ok=True)
+    cleanup()
+
+    start = datetime.combine(from_day, datetime.min.time()) if from_day else None
+    end = datetime.combine(to_day + timedelta(days=1), datetime.min.time()) if to_day else None
+
+    job = {
+        "id": uuid.uuid4().hex,
+        "format": fmt,
+        "state": "queued",
+        "filters": {
+            "from": from_day.isoformat() if from_day else None,
+            "to": to_day.isoformat() if to_day else None,
+            "school": school,
+        },
+        "rows_done": 0,
+        "rows_total": None,
+        "size": None,
+        "error": None,
+        "attempts": 0,
+        "requested_by": requested_by,
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "finished_at": None,
+    }
+    # Params first: the runner may pick the job up as soon as its status exists.
+    _params_path(job["id"]).write_text(json.dumps({
+        "start": start.isoformat() if start else None,
+        "end": end.isoformat() if end else None,
+        "student_ids": student_ids,
+    }), encoding="utf-8")
+    _write_status(job)
+    ensure_runner()
+    return job
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["worker"]:
+        sys.exit("usage: python export_jobs.py worker")
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    run_worker()
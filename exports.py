@@ -0,0 +1,230 @@
+"""
+Fault exports (CSV / XLSX / Parquet) with memory bounded by the chunk size.
+
+Faults are read through a server-side cursor (stream_results + yield_per),
+enriched per chunk from the cached Adon lookups (student name / ת.ז / school,
+lock type) and handed to the writer chunk by chunk — the full table is never
+materialised in pandas or in a BytesIO.
+
+  * CSV is produced as a generator of text blocks, so the route can stream
+    it and the first byte leaves immediately.
+  * XLSX uses openpyxl's write-only workbook (rows go straight to its temp
+    XML parts). The zip can only be assembled at save(), so it's written to
+    a temp file and then streamed from disk.
+  * Parquet (for the analysts' notebooks) writes one row group per chunk
+    with typed columns: real timestamps / booleans / ints, and dictionary
+    (pandas "category") columns for the low-cardinality labels. Needs
+    pyarrow, imported lazily so the rest of the app doesn't depend on it.
+"""
+
+import csv
+import io
+import os
+import tempfile
+from typing import Iterator, Optional
+
+from sqlalchemy import bindparam, text
+
+import db as adon_db
+
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", "2000"))
+
+# (field, Hebrew header), in output order — identifying info first.
+EXPORT_COLUMNS = [
+    ("id", "מספר תקלה"),
+    ("student_name", "שם תלמיד"),
+    ("student_tz", "ת.ז תלמיד"),
+    ("student_school", "בית ספר"),
+    ("locker_id", "מזהה לוקר"),
+    ("lock_type", "סוג מנעול"),
+    ("fault_type", "סוג תקלה"),
+    ("severity", "חומרה"),
+    ("books_stuck", "ספרים תקועים"),
+    ("is_urgent", "דחוף"),
+    ("is_recurring", "חוזרת"),
+    ("status", "סטטוס"),
+    ("description", "תיאור"),
+    ("created_at", "נפתחה ב"),
+    ("resolved_at", "נסגרה ב"),
+    ("assigned_technician", "טכנאי"),
+    ("technician_notes", "הערות טכנאי"),
+]
+EXPORT_HEADERS = [header for _, header in EXPORT_COLUMNS]
+
+_LOCK_TYPE_LABELS = {"digital": "דיגיטלי", "mechanical": "מכני"}
+
+_FAULT_COLUMNS_SQL = """
+    id, student_id_ext, locker_id, fault_type, severity, books_stuck,
+    is_urgent, is_recurring, status, description, created_at, resolved_at,
+    assigned_technician, technician_notes
+"""
+
+
+def _filtered(select_sql: str, start=None, end=None, student_ids: Optional[list] = None,
+              order_by: str = ""):
+    """faults query with the optional created_at window [start, end) and student filter."""
+    clauses, params = [], {}
+    if start is not None:
+        clauses.append("created_at >= :start")
+        params["start"] = start
+    if end is not None:
+        clauses.append("created_at < :end")
+        params["end"] = end
+    if student_ids is not None:
+        clauses.append("student_id_ext IN :student_ids")
+        params["student_ids"] = student_ids
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    stmt = text(f"SELECT {select_sql} FROM faults {where} {order_by}")
+    if student_ids is not None:
+        stmt = stmt.bindparams(bindparam("student_ids", expanding=True))
+    return stmt, params
+
+
+def count_export_rows(engine, start=None, end=None, student_ids: Optional[list] = None) -> int:
+    """How many faults an export with these filters will contain."""
+    if student_ids is not None and not student_ids:
+        return 0
+    stmt, params = _filtered("COUNT(*)", start, end, student_ids)
+    with engine.connect() as conn:
+        return int(conn.execute(stmt, params).scalar())
+
+
+def iter_export_chunks(engine, chunk_rows: int = EXPORT_CHUNK_ROWS, start=None, end=None,
+                       student_ids: Optional[list] = None) -> Iterator[list[list]]:
+    """
+    Yield lists of export rows (ordered as EXPORT_COLUMNS), `chunk_rows` at a
+    time. Optional filters: created_at in [start, end), student_id_ext in student_ids.
+    """
+    if student_ids is not None and not student_ids:
+        return
+    students = adon_db.get_students_by_id()
+    stmt, params = _filtered(_FAULT_COLUMNS_SQL, start, end, student_ids, "ORDER BY created_at DESC")
+
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(stmt, params)
+        for partition in result.mappings().partitions():
+            lockers = adon_db.get_lockers_by_ids(f["locker_id"] for f in partition)
+            chunk = []
+            for fault in partition:
+                student = students.get(fault["student_id_ext"]) or {}
+                row = dict(fault)
+                row["student_name"] = (
+                    f"{student.get('fname') or ''} {student.get('lname') or ''}".strip() or "לא ידוע"
+                )
+                row["student_tz"] = student.get("studentId") or ""
+                row["student_school"] = student.get("school_name") or ""
+                locker = lockers.get(fault["locker_id"]) or {}
+                row["lock_type"] = _LOCK_TYPE_LABELS.get(locker.get("lock_type"), "")
+                chunk.append([row[field] for field, _ in EXPORT_COLUMNS])
+            yield chunk
+
+
+def iter_csv(chunks) -> Iterator[str]:
+    """CSV text, one block per chunk. Starts with a BOM so Excel reads the Hebrew as UTF-8."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write("\ufeff")
+    writer.writerow(EXPORT_HEADERS)
+    yield buf.getvalue()
+    for chunk in chunks:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(chunk)
+        yield buf.getvalue()
+
+
+def write_csv(chunks, path: str) -> None:
+    """Write iter_csv() output to `path`."""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for block in iter_csv(chunks):
+            f.write(block)
+
+
+def write_xlsx(chunks, path: str) -> None:
+    """Write the export to `path` with a write-only (constant-memory) workbook."""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("תקלות")
+    ws.append(EXPORT_HEADERS)
+    for chunk in chunks:
+        for row in chunk:
+            ws.append(row)
+    wb.save(path)
+
+
+def _parquet_schema():
+    import pyarrow as pa
+
+    category = pa.dictionary(pa.int32(), pa.string())
+    types = {
+        "id": pa.int64(),
+        "student_school": category,
+        "lock_type": category,
+        "fault_type": category,
+        "severity": pa.int16(),
+        "books_stuck": pa.bool_(),
+        "is_urgent": pa.bool_(),
+        "is_recurring": pa.bool_(),
+        "status": category,
+        "created_at": pa.timestamp("us"),
+        "resolved_at": pa.timestamp("us"),
+        "assigned_technician": category,
+    }
+    # Column names stay in English here: this format is for code, not people.
+    return pa.schema([(field, types.get(field, pa.string())) for field, _ in EXPORT_COLUMNS])
+
+
+def write_parquet(chunks, path: str) -> None:
+    """Write the export to `path` as Parquet, one row group per chunk."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema()
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for chunk in chunks:
+            columns = list(zip(*chunk))
+            arrays = []
+            for field, values in zip(schema, columns):
+                if pa.types.is_dictionary(field.type):
+                    arrays.append(pa.array(values, pa.string()).dictionary_encode())
+                else:
+                    arrays.append(pa.array(values, field.type))
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+
+WRITERS = {"csv": write_csv, "xlsx": write_xlsx, "parquet": write_parquet}
+
+MIMETYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def export_tempfile(fmt: str, chunks) -> str:
+    """WRITERS[fmt] into a fresh temp file; the caller owns (and must delete) it."""
+    fd, path = tempfile.mkstemp(prefix="faults-export-", suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        WRITERS[fmt](chunks, path)
+    except Exception:
+        os.unlink(path)
+        raise
+    return path
+
+
+def iter_file_and_delete(path: str, block_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Stream a file in blocks, removing it once fully sent (or the client goes away)."""
+    try:
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                yield block
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
@@ -0,0 +1,220 @@
+"""
+Failure-rate scoring per locker, closet and school (nightly batch).
+
+We keep fixing the same closets. This job counts our faults per locker over
+the last FAILURE_SCORE_WINDOW_DAYS, maps lockers onto the Adon
+Locker -> Closet -> School hierarchy, and scores every unit against the
+fleet-wide rate:
+
+    fleet rate  λ = faults / lockers            (whole fleet, one window)
+    expected_u  = λ × lockers in unit u
+    z_u         = (faults_u − expected_u) / sqrt(expected_u)     (Poisson)
+
+A unit is an outlier when z ≥ FAILURE_SCORE_Z_THRESHOLD and it has at least
+FAILURE_SCORE_MIN_FAULTS faults (so a single fault on a one-locker closet
+doesn't light up). Scores are written to `failure_scores` in one
+transaction, so reads are a plain indexed SELECT.
+
+Adon is only asked for aggregates: locker counts per closet, and the closet
+of the lockers that actually have faults.
+
+Run by the in-app nightly thread (flask_app.py) or by hand:
+    python failure_scores.py
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import (
+    Boolean, Column, DateTime, Float, Index, Integer, MetaData, String, Table, text,
+)
+
+import db as adon_db
+
+FAILURE_SCORE_WINDOW_DAYS = int(os.environ.get("FAILURE_SCORE_WINDOW_DAYS", "365"))
+FAILURE_SCORE_Z_THRESHOLD = float(os.environ.get("FAILURE_SCORE_Z_THRESHOLD", "3.0"))
+FAILURE_SCORE_MIN_FAULTS = int(os.environ.get("FAILURE_SCORE_MIN_FAULTS", "3"))
+
+LEVELS = ("locker", "closet", "school")
+
+metadata = MetaData()
+
+failure_scores = Table(
+    "failure_scores", metadata,
+    Column("level", String, primary_key=True),      # locker | closet | school
+    Column("unit_id", String, primary_key=True),    # Locker.id / Closet.id / school name
+    Column("school", String, nullable=False),
+    Column("closet", String, nullable=True),        # Closet.name (locker / closet rows)
+    Column("cell_number", String, nullable=True),   # locker rows only
+    Column("lockers", Integer, nullable=False),     # fleet size of the unit
+    Column("faults", Integer, nullable=False),
+    Column("rate", Float, nullable=False),          # faults per locker in the window
+    Column("expected", Float, nullable=False),
+    Column("z_score", Float, nullable=False),
+    Column("is_outlier", Boolean, nullable=False),
+    Column("computed_at", DateTime, nullable=False),
+    Index("ix_failure_scores_level_z", "level", "z_score"),
+)
+
+# Postgres advisory lock key, so only one worker runs the job at a time.
+_LOCK_KEY = 4_204_201
+
+
+_FAULTS_PER_LOCKER_SQL = text("""
+    SELECT locker_id, COUNT(*) FROM faults
+    WHERE locker_id IS NOT NULL AND created_at >= :since
+    GROUP BY locker_id
+""")
+
+_CLOSET_FLEET_SQL = text("""
+    SELECT c.id, c.name, MIN(sch.name), COUNT(*)
+    FROM "Locker" l
+    JOIN "Closet" c   ON c.id   = l."closetId"
+    JOIN "School" sch ON sch.id = l."schoolId"
+    GROUP BY c.id, c.name
+""")
+
+_LOCKER_CLOSETS_SQL = text("""
+    SELECT l.id, l."closetId", l."lockerNumber"::text
+    FROM "Locker" l
+    WHERE l.id = ANY(:locker_ids)
+""")
+
+
+def ensure_schema(engine) -> None:
+    metadata.create_all(engine)
+
+
+def _poisson_scores(faults: np.ndarray, lockers: np.ndarray, fleet_rate: float):
+    """(rate, expected, z, is_outlier) arrays for units with `faults` over `lockers`."""
+    lockers = np.maximum(lockers, 1)
+    expected = fleet_rate * lockers
+    z = np.where(expected > 0, (faults - expected) / np.sqrt(np.maximum(expected, 1e-9)), 0.0)
+    outlier = (z >= FAILURE_SCORE_Z_THRESHOLD) & (faults >= FAILURE_SCORE_MIN_FAULTS)
+    return faults / lockers, expected, z, outlier
+
+
+def compute(our_engine, adon_engine, now: Optional[datetime] = None) -> list[dict]:
+    """Score rows for every locker / closet / school with at least one fault in the window."""
+    now = now or datetime.utcnow()
+    since = now - timedelta(days=FAILURE_SCORE_WINDOW_DAYS)
+
+    with our_engine.connect() as conn:
+        per_locker = conn.execute(_FAULTS_PER_LOCKER_SQL, {"since": since}).fetchall()
+    with adon_engine.connect() as conn:
+        closets = conn.execute(_CLOSET_FLEET_SQL).fetchall()
+        locker_rows = []
+        locker_ids = [r[0] for r in per_locker]
+        for start in range(0, len(locker_ids), 500):
+            locker_rows += conn.execute(
+                _LOCKER_CLOSETS_SQL, {"locker_ids": locker_ids[start:start + 500]}
+            ).fetchall()
+
+    if not closets:
+        return []
+
+    # Closet-indexed fleet arrays.
+    closet_ids = [c[0] for c in closets]
+    closet_pos = {cid: i for i, cid in enumerate(closet_ids)}
+    closet_names = [c[1] for c in closets]
+    closet_schools = [c[2] for c in closets]
+    closet_lockers = np.array([c[3] for c in closets], dtype=float)
+    fleet_lockers = closet_lockers.sum()
+
+    # Faulted lockers that still exist in Adon, with their closet position.
+    faults_by_locker = {r[0]: r[1] for r in per_locker}
+    known = [(lid, closet_pos[cid], cell) for lid, cid, cell in locker_rows if cid in closet_pos]
+    locker_faults = np.array([faults_by_locker[lid] for lid, _, _ in known], dtype=float)
+    locker_closet = np.array([pos for _, pos, _ in known], dtype=np.int64)
+
+    fleet_rate = locker_faults.sum() / fleet_lockers if fleet_lockers else 0.0
+    rows = []
+
+    def emit(level, unit_ids, schools, closets_, cells, lockers, faults):
+        rate, expected, z, outlier = _poisson_scores(faults, lockers, fleet_rate)
+        for i in np.flatnonzero(faults > 0):
+            rows.append({
+                "level": level,
+                "unit_id": str(unit_ids[i]),
+                "school": schools[i] or "",
+                "closet": closets_[i] if closets_ is not None else None,
+                "cell_number": cells[i] if cells is not None else None,
+                "lockers": int(lockers[i]),
+                "faults": int(faults[i]),
+                "rate": round(float(rate[i]), 4),
+                "expected": round(float(expected[i]), 4),
+                "z_score": round(float(z[i]), 3),
+                "is_outlier": bool(outlier[i]),
+                "computed_at": now,
+            })
+
+    # Lockers: each is a fleet of one.
+    emit("locker", [lid for lid, _, _ in known],
+         [closet_schools[p] for p in locker_closet], [closet_names[p] for p in locker_closet],
+         [cell for _, _, cell in known], np.ones(len(known)), locker_faults)
+
+    # Closets: sum locker faults into their closet.
+    closet_faults = np.bincount(locker_closet, weights=locker_faults, minlength=len(closet_ids))
+    emit("closet", closet_ids, closet_schools, closet_names, None, closet_lockers, closet_faults)
+
+    # Schools: sum closets into schools.
+    school_names, school_of_closet = np.unique(np.asarray(closet_schools, dtype=str), return_inverse=True)
+    school_faults = np.bincount(school_of_closet, weights=closet_faults, minlength=len(school_names))
+    school_lockers = np.bincount(school_of_closet, weights=closet_lockers, minlength=len(school_names))
+    emit("school", school_names, school_names, None, None, school_lockers, school_faults)
+    return rows
+
+
+def refresh(our_engine, adon_engine=None, max_age: Optional[timedelta] = None) -> Optional[int]:
+    """
+    Recompute and replace all scores. With `max_age`, skip (return None) if the
+    stored scores are younger than that. Also returns None if another worker
+    holds the job lock. Otherwise returns the number of rows written.
+    """
+    adon_engine = adon_engine or adon_db.get_adon_engine()
+    with our_engine.begin() as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:k)"), {"k": _LOCK_KEY}).scalar():
+            return None
+        if max_age is not None:
+            last = conn.execute(text("SELECT MAX(computed_at) FROM failure_scores")).scalar()
+            if last is not None and datetime.utcnow() - last < max_age:
+                return None
+        rows = compute(our_engine, adon_engine)
+        conn.execute(failure_scores.delete())
+        if rows:
+            conn.execute(failure_scores.insert(), rows)
+        return len(rows)
+
+
+def worst(conn, level: str, limit: int = 20, outliers_only: bool = False,
+          school: Optional[str] = None) -> list[dict]:
+    """Stored scores for `level`, highest z first."""
+    clauses = ["level = :level"]
+    params = {"level": level, "limit": limit}
+    if outliers_only:
+        clauses.append("is_outlier")
+    if school:
+        clauses.append("school = :school")
+        params["school"] = school
+    rows = conn.execute(text(f"""
+        SELECT unit_id, school, closet, cell_number, lockers, faults, rate, expected,
+               z_score, is_outlier, computed_at
+        FROM failure_scores WHERE {" AND ".join(clauses)}
+        ORDER BY z_score DESC, faults DESC LIMIT :limit
+    """), params).mappings().fetchall()
+    return [
+        {**dict(r), "computed_at": r["computed_at"].isoformat() + "Z"}
+        for r in rows
+    ]
+
+
+if __name__ == "__main__":
+    engine = adon_db.get_our_engine()
+    ensure_schema(engine)
+    written = refresh(engine)
+    if written is None:
+        sys.exit("failure_scores: another worker is already running the job")
+    print(f"failure_scores: {written} rows")
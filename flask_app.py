@@ -9,23 +9,46 @@ DB config comes from env vars:
     ADON_LOCKER_DATABASE_URL  — Netanel's Supabase. Read-only.
 """
 
+import json
+import logging
 import os
+import sqlite3
+import threading
+import time
 from collections import Counter
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import pandas as pd
 from dotenv import load_dotenv
 from flask import Flask, jsonify, render_template, render_template_string, request
-from sqlalchemy import Boolean, Column, DateTime, Integer, String, create_engine
+from sqlalchemy import Boolean, Column, DateTime, Index, Integer, String, create_engine, text, update
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+import analytics
 import db as adon_db
+import export_jobs
+import exports
+import failure_scores
+import forecasting
+import geo
+import hotspots
+import shared_state
+import workload
 from auth import init_auth
 from bot_api import bot_bp, init_bot_api
+from scheduling import (
+    REGION_PROXIMITY,
+    order_route,
+    run_scheduling_algorithm,
+    solve_assignment,
+    what_if,
+)
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)  # the same logger as app.logger
+
 # ============================================================================
 # FLASK APP
 # ============================================================================
@@ -65,12 +88,128 @@ class Fault(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     resolved_at = Column(DateTime, nullable=True)
     assigned_technician = Column(String, nullable=True)
+    # Technician the close was counted under in fault_daily_rollup ('' = none).
+    resolved_technician = Column(String, nullable=True)
     technician_notes = Column(String, nullable=True)
 
+    __table_args__ = (
+        # Bot status lookup: "open fault?" / "closed recently?" per student.
+        Index("ix_faults_student_status_resolved", "student_id_ext", "status", "resolved_at"),
+    )
+
+
+class BotIdempotencyKey(Base):
+    """A successful POST /api/bot/fault, replayed when the bot retries with the same Idempotency-Key."""
+    __tablename__ = "bot_idempotency_keys"
+
+    key = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False)
+    response = Column(String, nullable=False)  # JSON body
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
 
 Base.metadata.create_all(our_engine)
+# create_all skips tables that already exist, so add indexes declared later here.
+for _index in Fault.__table__.indexes:
+    _index.create(our_engine, checkfirst=True)
+# ...and columns.
+with our_engine.begin() as _conn:
+    _conn.execute(text("ALTER TABLE faults ADD COLUMN IF NOT EXISTS resolved_technician VARCHAR"))
+analytics.ensure_schema(our_engine)
+failure_scores.ensure_schema(our_engine)
+forecasting.ensure_schema(our_engine)
 OurSession = sessionmaker(bind=our_engine)
 
+
+# ============================================================================
+# FAULT-DERIVED CACHES (shared across workers via shared_state.py)
+# ============================================================================
+
+_REPORT_CACHE_MAX_AGE_SECONDS = int(os.environ.get("REPORT_CACHE_MAX_AGE_SECONDS", "300"))
+_reports_need_warming = threading.Event()
+
+
+def _faults_changed():
+    """Call after committing any change to `faults`: every worker's fault-derived caches go stale."""
+    try:
+        shared_state.bump_generation()
+    except Exception:
+        logger.exception("shared_state generation bump failed")
+    _reports_need_warming.set()
+
+
+def _fault_created(fault) -> list[dict]:
+    """Feed a newly committed fault to the burst detector; returns the alerts it raised."""
+    alerts = hotspots.observe_fault(fault.student_id_ext, fault.locker_id)
+    for alert in alerts:
+        logger.warning("hotspot burst at %s %s: %s recent vs %s expected",
+                       alert["kind"], alert["key"], alert["recent"], alert["expected"])
+    return alerts
+
+
+def _warm_reports():
+    # Recompute the all-schools dashboard right after each invalidation, so
+    # nobody opening /reports pays for it. A burst of writes collapses into
+    # one recompute.
+    while True:
+        _reports_need_warming.wait()
+        _reports_need_warming.clear()
+        try:
+            _cached_report_stats("")
+        except Exception:
+            logger.exception("warming the stats cache failed")
+
+
+def _backfill_rollup_if_empty():
+    # First deploy with the rollup: build history in the background, once
+    # (fault_daily_rollup_built); backfill() locks, so the second worker just
+    # finds it built. After wiping the rollup, run `python analytics.py backfill`.
+    try:
+        if analytics.backfill(our_engine, only_if_unbuilt=True):  # rows written
+            _faults_changed()
+    except Exception:
+        logger.exception("rollup backfill failed")
+
+
+threading.Thread(target=_warm_reports, name="report-warmer", daemon=True).start()
+threading.Thread(target=_backfill_rollup_if_empty, daemon=True).start()
+
+# Export jobs left queued by a restart: start their runner (export_jobs.py).
+try:
+    export_jobs.resume()
+except OSError:
+    logger.exception("could not resume queued export jobs")
+
+# ============================================================================
+# NIGHTLY JOBS (failure_scores.py, forecasting.py)
+# Each job stores its results in our DB and skips itself while they're fresh
+# (and takes a Postgres advisory lock), so every worker can run this loop.
+# ============================================================================
+
+_NIGHTLY_JOBS_HOUR_UTC = int(os.environ.get("NIGHTLY_JOBS_HOUR_UTC", "0"))  # 02:00/03:00 in Israel
+
+_NIGHTLY_JOBS = {
+    "failure_scores": lambda max_age: failure_scores.refresh(our_engine, max_age=max_age),
+    "forecasting": lambda max_age: forecasting.refresh(our_engine, max_age=max_age),
+}
+
+
+def _run_nightly_jobs():
+    while True:
+        # In the nightly hour, refresh anything from yesterday; at other times
+        # only fill in results that are missing or a missed night left stale.
+        nightly = datetime.utcnow().hour == _NIGHTLY_JOBS_HOUR_UTC
+        max_age = timedelta(hours=20) if nightly else timedelta(hours=30)
+        for name, job in _NIGHTLY_JOBS.items():
+            try:
+                job(max_age)
+            except Exception:
+                logger.exception("nightly job %s failed", name)
+        time.sleep(3600)
+
+
+threading.Thread(target=_run_nightly_jobs, name="nightly-jobs", daemon=True).start()
+
 # ============================================================================
 # SCHOOL → REGION MAPPING (DYNAMIC)
 # School names come live from Netanel's DB; region overrides are kept in
@@ -99,14 +238,7 @@ TECHNICIANS = [
     {"id": 4, "name": "טכנאי 4", "home_region": "South"},
 ]
 
-REGION_PROXIMITY = {
-    "South":     {"South": 0, "Lowland": 1, "Jerusalem": 2, "Center": 3, "North": 4},
-    "Jerusalem": {"Jerusalem": 0, "Center": 1, "South": 2, "Lowland": 2, "North": 3},
-    "Center":    {"Center": 0, "Jerusalem": 1, "Lowland": 1, "North": 2, "South": 3},
-    "North":     {"North": 0, "Center": 1, "Lowland": 2, "Jerusalem": 2, "South": 4},
-    "Lowland":   {"Lowland": 0, "Center": 1, "North": 1, "Jerusalem": 2, "South": 2},
-    "Unknown":   {"South": 2, "Jerusalem": 2, "Center": 2, "North": 2, "Lowland": 2},
-}
+# REGION_PROXIMITY lives in scheduling.py, shared with both planners.
 
 SEVERITY_MAP = {
     "מנעול התקלקל": 5,
@@ -146,11 +278,15 @@ def _students_dataframe() -> pd.DataFrame:
 
 # Wire the bot API blueprint (token-authenticated /api/bot/* surface).
 # A bot fault is created exactly like a form fault (severity derived from
-# fault_type, no technician assigned on creation), so only these are injected.
+# fault_type, no technician assigned on creation), so only these are injected
+# — plus the post-commit hook every fault write goes through.
 init_bot_api(
     OurSession=OurSession,
     Fault=Fault,
+    IdempotencyKey=BotIdempotencyKey,
     get_severity=get_severity,
+    on_faults_changed=_faults_changed,
+    on_fault_created=_fault_created,
 )
 app.register_blueprint(bot_bp)
 
@@ -191,6 +327,7 @@ def get_faults():
     try:
         faults = session.query(Fault).order_by(Fault.created_at.desc()).all()
         students_df = _students_dataframe()
+        lockers = adon_db.get_lockers_by_ids(f.locker_id for f in faults)
 
         result = []
         for fault in faults:
@@ -229,7 +366,7 @@ def get_faults():
 
             # Locker enrichment for the mobile / detail views (cached upstream)
             if fault.locker_id:
-                locker = adon_db.get_locker_by_id(fault.locker_id)
+                locker = lockers.get(fault.locker_id)
                 if locker:
                     fault_dict["locker_info"] = {
                         "cabinet_name": locker.get("cabinet_name"),
@@ -279,14 +416,22 @@ def create_fault():
         )
 
         session.add(new_fault)
+        session.flush()
+        analytics.record_opened(session.connection(), new_fault)
         session.commit()
         session.refresh(new_fault)
+        _faults_changed()
+        alerts = _fault_created(new_fault)
 
+        message = f'תקלה נוצרה בהצלחה{" (זוהתה כתקלה חוזרת)" if is_recurring else ""}'
+        for alert in alerts:
+            message += f" — שימי לב: ריבוי תקלות ב{hotspots.KIND_LABELS[alert['kind']]} {alert['key']}"
         return jsonify({
             "success": True,
             "fault_id": new_fault.id,
             "is_recurring": is_recurring,
-            "message": f'תקלה נוצרה בהצלחה{" (זוהתה כתקלה חוזרת)" if is_recurring else ""}',
+            "hotspots": alerts,
+            "message": message,
         })
     except Exception as e:
         session.rollback()
@@ -404,7 +549,7 @@ def update_status():
         if not fault:
             return jsonify({"success": False, "error": "Fault not found"}), 404
 
-        old_status = fault.status
+        old_status, old_resolved_at, old_technician = fault.status, fault.resolved_at, fault.assigned_technician
         new_status = data["status"]
         fault.status = new_status
 
@@ -416,7 +561,9 @@ def update_status():
         if "technician" in data:
             fault.assigned_technician = data["technician"]
 
+        analytics.record_status_change(session.connection(), fault, old_status, old_resolved_at, old_technician)
         session.commit()
+        _faults_changed()
 
         # Status transition → SILENT bot sync (2026-07-19): the bot updates its
         # cards/console; the customer WhatsApp is the operator's dedicated button.
@@ -443,7 +590,7 @@ def update_fault_with_notes():
         if not fault:
             return jsonify({"success": False, "error": "Fault not found"}), 404
 
-        old_status = fault.status
+        old_status, old_resolved_at, old_technician = fault.status, fault.resolved_at, fault.assigned_technician
         if "status" in data:
             new_status = data["status"]
             fault.status = new_status
@@ -457,7 +604,9 @@ def update_fault_with_notes():
         if "technician" in data:
             fault.assigned_technician = data["technician"]
 
+        analytics.record_status_change(session.connection(), fault, old_status, old_resolved_at, old_technician)
         session.commit()
+        _faults_changed()
 
         # Status transition → SILENT bot sync (same hook as /api/update_status).
         bot_synced = None
@@ -516,207 +665,63 @@ def notify_resolved():
         session.close()
 
 
-# ============================================================================
-# SCHEDULING ALGORITHM (unchanged business logic)
-# ============================================================================
+@app.route("/api/technicians", methods=["GET"])
+def get_technicians():
+    """Technicians list with current workload + most-frequent active region."""
+    result = []
+    for tech in TECHNICIANS:
+        open_count, current_region, _schools = workload.technician_load(tech)
+        result.append({
+            "id": tech["id"],
+            "name": tech["name"],
+            "home_region": tech["home_region"],
+            "current_region": current_region,
+            "open_faults": open_count,
+        })
 
-def run_scheduling_algorithm(faults_df, num_technicians):
-    """
-    Weighted Engineering Heuristic for technician assignment.
-
-    Priority Score (per school) = 0.35*N + 0.25*U + 0.25*T + 0.15*R
-      N  — Batching (35%): clustered faults at one school amortise travel (Benjaafar)
-      U  — RCM (25%): functional severity (1=aesthetic, 5=blocking) (WBDG)
-      T  — Max-Min Fairness (25%): wait time builds priority (Ghaderi)
-      R  — Service Recovery (15%): recurring failures get a boost (Matos)
-
-    TOC override (Theory of Constraints): if any fault at the school is
-    `books_stuck` OR `is_urgent`, score is set to a sentinel that forces
-    that school to the front of the queue.
-
-    Assignment is then done in three phases:
-      Phase 1 — anchor each tech to the next-highest-scoring school
-      Phase 2 — each tech absorbs all unassigned schools in their region
-      Phase 3 — overflow goes to the least-loaded tech
-    """
-    if faults_df.empty:
-        return {}
+    return jsonify({"success": True, "technicians": result})
 
-    now = datetime.utcnow()
-    faults_df["age_days"] = faults_df["created_at"].apply(
-        lambda x: (now - x).total_seconds() / 86400 if x else 0
-    )
 
-    school_metrics = faults_df.groupby("school_name").agg({
-        "fault_id": "count",
-        "severity": "mean",
-        "age_days": "max",
-        "is_recurring": "max",
-        "is_urgent": "max",
-        "books_stuck": "max",
-        "region": "first",
-    }).reset_index()
-
-    school_metrics.columns = [
-        "school_name", "fault_count", "avg_severity", "max_age_days",
-        "has_recurring", "has_urgent", "has_books_stuck", "region",
-    ]
-
-    # Normalise each component to a [1, 5] scale so weights are comparable.
-    school_metrics["N"] = school_metrics["fault_count"].apply(lambda x: min(x, 5))
-    school_metrics["U"] = school_metrics["avg_severity"]
-    # Fairness: 12-day gradient instead of 5 — gives meaningful priority growth
-    # across a full school fortnight before saturating.
-    school_metrics["T"] = school_metrics["max_age_days"].apply(
-        lambda x: min(1 + (max(x, 0) / 3), 5)
-    )
-    school_metrics["R"] = school_metrics["has_recurring"].apply(lambda x: 5 if x else 1)
+def _rank_technicians(fault_region, loads, fault_school=None, distances=None):
+    """
+    Technicians ordered best-first for a fault in `fault_region`.
 
-    school_metrics["priority_score"] = (
-        0.35 * school_metrics["N"]
-        + 0.25 * school_metrics["U"]
-        + 0.25 * school_metrics["T"]
-        + 0.15 * school_metrics["R"]
+    `loads` is {tech_name: (open_faults, current_region, active_schools)}.
+    Score is 3 × distance + current open faults (lower is better). Distance
+    is in REGION_PROXIMITY steps; when school coordinates are available
+    (`distances`, see geo.py) it's the km from the fault's school to the
+    technician's nearest active school / home base, converted to steps.
+    """
+    prox = REGION_PROXIMITY.get(
+        fault_region,
+        {k: 2 for k in ["South", "Jerusalem", "Center", "North", "Lowland"]},
     )
-    # TOC override: blockers (books locked inside the locker, or marked urgent)
-    # jump the entire queue regardless of other components.
-    toc_blocker = (school_metrics["has_urgent"] == True) | (school_metrics["has_books_stuck"] == True)
-    school_metrics.loc[toc_blocker, "priority_score"] = 10000
-
-    school_metrics = school_metrics.sort_values("priority_score", ascending=False).reset_index(drop=True)
-    school_metrics["assigned"] = False
-
-    assignments = {}
-    technician_workload = {}
-    tech_primary_region = {}
-
-    for i in range(1, num_technicians + 1):
-        tech_name = f"טכנאי {i}"
-        assignments[tech_name] = []
-        technician_workload[tech_name] = 0
-        tech_primary_region[tech_name] = None
-
-    total_faults = len(faults_df)
-    workload_cap = (total_faults / num_technicians) * 1.5
-
-    # Phase 1: Anchor seeding
-    num_anchors = min(num_technicians, len(school_metrics))
-    for i in range(num_anchors):
-        school = school_metrics.iloc[i]
-        tech_name = f"טכנאי {i + 1}"
-        school_name = school["school_name"]
-        region = school["region"]
-        num_faults = school["fault_count"]
-
-        assignments[tech_name].append({
-            "school_name": school_name,
-            "region": region,
-            "priority_score": float(school["priority_score"]),
-            "num_faults": int(num_faults),
-            "is_urgent": bool(school["has_urgent"]),
-            "avg_severity": float(school["avg_severity"]),
-            "oldest_fault_days": float(school["max_age_days"]),
-            "faults": faults_df[faults_df["school_name"] == school_name].to_dict(orient="records"),
-            "assignment_type": "Phase 1 - Anchor",
-        })
 
-        technician_workload[tech_name] += num_faults
-        tech_primary_region[tech_name] = region
-        school_metrics.loc[i, "assigned"] = True
+    ranked = []
+    for tech in TECHNICIANS:
+        open_count, current_region, active_schools = loads[tech["name"]]
 
-    # Phase 2: Strict region exhaustion
-    for tech_name, primary_region in tech_primary_region.items():
-        if not primary_region:
-            continue
-        region_schools = school_metrics[
-            (~school_metrics["assigned"]) & (school_metrics["region"] == primary_region)
-        ]
-        for idx, school in region_schools.iterrows():
-            num_faults = school["fault_count"]
-            if technician_workload[tech_name] + num_faults <= workload_cap:
-                school_name = school["school_name"]
-                assignments[tech_name].append({
-                    "school_name": school_name,
-                    "region": primary_region,
-                    "priority_score": float(school["priority_score"]),
-                    "num_faults": int(num_faults),
-                    "is_urgent": bool(school["has_urgent"]),
-                    "avg_severity": float(school["avg_severity"]),
-                    "oldest_fault_days": float(school["max_age_days"]),
-                    "faults": faults_df[faults_df["school_name"] == school_name].to_dict(orient="records"),
-                    "assignment_type": "Phase 2 - Region Absorbed",
-                })
-                technician_workload[tech_name] += num_faults
-                school_metrics.loc[idx, "assigned"] = True
-
-    # Phase 3: Global leftovers
-    unassigned_schools = school_metrics[~school_metrics["assigned"]]
-    for idx, school in unassigned_schools.iterrows():
-        num_faults = school["fault_count"]
-        school_name = school["school_name"]
-        region = school["region"]
-        best_tech = min(technician_workload.items(), key=lambda x: x[1])[0]
-
-        assignments[best_tech].append({
-            "school_name": school_name,
-            "region": region,
-            "priority_score": float(school["priority_score"]),
-            "num_faults": int(num_faults),
-            "is_urgent": bool(school["has_urgent"]),
-            "avg_severity": float(school["avg_severity"]),
-            "oldest_fault_days": float(school["max_age_days"]),
-            "faults": faults_df[faults_df["school_name"] == school_name].to_dict(orient="records"),
-            "assignment_type": "Phase 3 - Overflow Leftover",
+        km = None
+        if distances is not None and fault_school:
+            km = distances.nearest_km(fault_school, active_schools, tech["name"])
+        if km is not None:
+            dist = round(km / geo.KM_PER_PROXIMITY_STEP, 2)
+        else:
+            dist = prox.get(current_region, 3)
+        score = dist * 3 + open_count
+
+        ranked.append({
+            "id": tech["id"],
+            "name": tech["name"],
+            "current_region": current_region,
+            "open_faults": open_count,
+            "distance_score": dist,
+            "distance_km": round(km, 1) if km is not None else None,
+            "total_score": score,
         })
-        technician_workload[best_tech] += num_faults
-        school_metrics.loc[idx, "assigned"] = True
 
-    return assignments
-
-
-@app.route("/api/technicians", methods=["GET"])
-def get_technicians():
-    """Technicians list with current workload + most-frequent active region."""
-    session = OurSession()
-    try:
-        open_faults = session.query(Fault).filter(
-            Fault.status == "Open",
-            Fault.assigned_technician != None,  # noqa: E711
-        ).all()
-
-        students_df = _students_dataframe()
-
-        workload = {}
-        for fault in open_faults:
-            tech = fault.assigned_technician
-            if tech not in workload:
-                workload[tech] = {"count": 0, "regions": []}
-            workload[tech]["count"] += 1
-            if not students_df.empty:
-                si = students_df[students_df["id"] == fault.student_id_ext]
-                if not si.empty:
-                    sn = si.iloc[0].get("school_name", "Unknown")
-                    workload[tech]["regions"].append(school_mapping().get(sn, "Unknown"))
-
-        result = []
-        for tech in TECHNICIANS:
-            tech_name = tech["name"]
-            wl = workload.get(tech_name, {"count": 0, "regions": []})
-            if wl["regions"]:
-                current_region = Counter(wl["regions"]).most_common(1)[0][0]
-            else:
-                current_region = tech["home_region"]
-            result.append({
-                "id": tech["id"],
-                "name": tech_name,
-                "home_region": tech["home_region"],
-                "current_region": current_region,
-                "open_faults": wl["count"],
-            })
-
-        return jsonify({"success": True, "technicians": result})
-    finally:
-        session.close()
+    ranked.sort(key=lambda x: x["total_score"])
+    return ranked
 
 
 @app.route("/api/suggest_technician", methods=["POST"])
@@ -731,58 +736,9 @@ def suggest_technician():
         if not fault:
             return jsonify({"success": False, "error": "Fault not found"}), 404
 
-        students_df = _students_dataframe()
-
-        fault_region = "Unknown"
-        if not students_df.empty:
-            si = students_df[students_df["id"] == fault.student_id_ext]
-            if not si.empty:
-                sn = si.iloc[0].get("school_name", "Unknown")
-                fault_region = school_mapping().get(sn, "Unknown")
-
-        open_faults = session.query(Fault).filter(
-            Fault.status == "Open",
-            Fault.assigned_technician != None,  # noqa: E711
-        ).all()
-        workload = {}
-        for of in open_faults:
-            tech = of.assigned_technician
-            if tech not in workload:
-                workload[tech] = {"count": 0, "regions": []}
-            workload[tech]["count"] += 1
-            if not students_df.empty:
-                si2 = students_df[students_df["id"] == of.student_id_ext]
-                if not si2.empty:
-                    sn2 = si2.iloc[0].get("school_name", "Unknown")
-                    workload[tech]["regions"].append(school_mapping().get(sn2, "Unknown"))
-
-        prox = REGION_PROXIMITY.get(
-            fault_region,
-            {k: 2 for k in ["South", "Jerusalem", "Center", "North", "Lowland"]},
-        )
-
-        ranked = []
-        for tech in TECHNICIANS:
-            tech_name = tech["name"]
-            wl = workload.get(tech_name, {"count": 0, "regions": []})
-            if wl["regions"]:
-                current_region = Counter(wl["regions"]).most_common(1)[0][0]
-            else:
-                current_region = tech["home_region"]
-
-            dist = prox.get(current_region, 3)
-            score = dist * 3 + wl["count"]
-
-            ranked.append({
-                "id": tech["id"],
-                "name": tech_name,
-                "current_region": current_region,
-                "open_faults": wl["count"],
-                "distance_score": dist,
-                "total_score": score,
-            })
-
-        ranked.sort(key=lambda x: x["total_score"])
+        fault_school, fault_region = adon_db.get_region_for_student(fault.student_id_ext)
+        loads = {tech["name"]: workload.technician_load(tech) for tech in TECHNICIANS}
+        ranked = _rank_technicians(fault_region, loads, fault_school, geo.get_distance_matrix())
         return jsonify({
             "success": True,
             "fault_region": fault_region,
@@ -806,6 +762,7 @@ def assign_fault():
 
         fault.assigned_technician = technician_name
         session.commit()
+        _faults_changed()
         return jsonify({"success": True, "message": f"התקלה הוקצתה ל-{technician_name}"})
     except Exception as e:
         session.rollback()
@@ -814,10 +771,165 @@ def assign_fault():
         session.close()
 
 
+@app.route("/api/assign_unassigned", methods=["POST"])
+def assign_unassigned():
+    """
+    Auto-assign every open, unassigned fault in one pass.
+
+    Same score as /api/suggest_technician, but the workload is updated as we
+    go so a backlog spreads across technicians instead of piling on the
+    first-ranked one. Urgent faults pick first, then oldest. All assignments
+    commit in a single transaction; faults assigned or closed concurrently
+    are skipped and listed in "skipped".
+    """
+    session = OurSession()
+    try:
+        pending = session.query(Fault.id, Fault.student_id_ext).filter(
+            Fault.status == "Open",
+            Fault.assigned_technician == None,  # noqa: E711
+        ).order_by(Fault.is_urgent.desc(), Fault.created_at.asc()).all()
+        if not pending:
+            return jsonify({"success": True, "message": "אין תקלות פתוחות שלא הוקצו", "assigned": []})
+
+        current = workload.get_workload()
+        distances = geo.get_distance_matrix()
+        counts = {}
+        regions = {}
+        schools = {}
+        for tech in TECHNICIANS:
+            wl = current.get(tech["name"])
+            counts[tech["name"]] = wl["count"] if wl else 0
+            regions[tech["name"]] = Counter(wl["regions"]) if wl else Counter()
+            schools[tech["name"]] = set(wl["schools"]) if wl else set()
+
+        def loads():
+            return {
+                tech["name"]: (
+                    counts[tech["name"]],
+                    regions[tech["name"]].most_common(1)[0][0] if regions[tech["name"]] else tech["home_region"],
+                    schools[tech["name"]],
+                )
+                for tech in TECHNICIANS
+            }
+
+        fault_ids_by_tech = {}
+        assigned = []
+        for fault_id, student_id_ext in pending:
+            fault_school, fault_region = adon_db.get_region_for_student(student_id_ext)
+            best = _rank_technicians(fault_region, loads(), fault_school, distances)[0]
+            counts[best["name"]] += 1
+            regions[best["name"]][fault_region] += 1
+            if fault_school:
+                schools[best["name"]].add(fault_school)
+            fault_ids_by_tech.setdefault(best["name"], []).append(fault_id)
+            assigned.append({
+                "fault_id": fault_id,
+                "fault_region": fault_region,
+                "technician_name": best["name"],
+                "total_score": best["total_score"],
+            })
+
+        updated = _persist_assignments(session, fault_ids_by_tech, only_unassigned=True)
+        session.commit()
+        _faults_changed()
+
+        # Faults assigned or closed by someone else meanwhile keep their state.
+        skipped = [a["fault_id"] for a in assigned if a["fault_id"] not in updated]
+        assigned = [a for a in assigned if a["fault_id"] in updated]
+        message = f"הוקצו {len(assigned)} תקלות"
+        if skipped:
+            message += f" ({len(skipped)} דולגו — הוקצו או נסגרו בינתיים)"
+        return jsonify({
+            "success": True,
+            "message": message,
+            "assigned": assigned,
+            "skipped": skipped,
+        })
+    except Exception as e:
+        session.rollback()
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        session.close()
+
+
+def _schedule_snapshot(open_faults) -> pd.DataFrame:
+    """Open faults enriched with student / school / region / lock type for the planners."""
+    students_df = _students_dataframe()
+    lockers = adon_db.get_lockers_by_ids(f.locker_id for f in open_faults)
+
+    faults_data = []
+    for fault in open_faults:
+        student_name = "Unknown"
+        school_name = "Unknown"
+        if not students_df.empty:
+            student_info = students_df[students_df["id"] == fault.student_id_ext]
+            if not student_info.empty:
+                school_name = student_info.iloc[0].get("school_name", "Unknown")
+                student_name = f"{student_info.iloc[0]['fname']} {student_info.iloc[0]['lname']}"
+
+        # Lock type drives which equipment the technician needs to bring.
+        locker = lockers.get(fault.locker_id) if fault.locker_id else None
+        lock_type = locker.get("lock_type") if locker else None
+
+        region = get_school_region(school_name)
+        faults_data.append({
+            "fault_id": fault.id,
+            "student_name": student_name,
+            "school_name": school_name,
+            "region": region,
+            "fault_type": fault.fault_type,
+            "severity": fault.severity,
+            "is_urgent": fault.is_urgent,
+            "books_stuck": fault.books_stuck,
+            "is_recurring": getattr(fault, "is_recurring", False),
+            "created_at": fault.created_at,
+            "lock_type": lock_type,
+        })
+    return pd.DataFrame(faults_data)
+
+
+def _persist_assignments(session, fault_ids_by_tech, only_unassigned=False) -> set:
+    """
+    Write {technician: [fault_id, ...]} as one set-based UPDATE per technician.
+
+    Runs inside the caller's transaction (the caller commits), so a schedule
+    for thousands of faults is a handful of round trips instead of one UPDATE
+    per ORM object. Returns the ids it updated. By default raises if that
+    isn't every id, so a partial write is rolled back rather than committed.
+    With `only_unassigned`, faults someone assigned or closed meanwhile are
+    left alone and simply missing from the result, for the caller to report.
+    """
+    expected = 0
+    updated = set()
+    for tech_name, fault_ids in fault_ids_by_tech.items():
+        if not fault_ids:
+            continue
+        expected += len(fault_ids)
+        stmt = update(Fault).where(Fault.id.in_(fault_ids))
+        if only_unassigned:
+            stmt = stmt.where(Fault.assigned_technician == None, Fault.status == "Open")  # noqa: E711
+        result = session.execute(
+            stmt.values(assigned_technician=tech_name)
+            .returning(Fault.id)
+            .execution_options(synchronize_session=False)
+        )
+        updated.update(result.scalars())
+    if not only_unassigned and len(updated) != expected:
+        raise RuntimeError(f"שמירת הסידור נכשלה: עודכנו {len(updated)} מתוך {expected} תקלות")
+    return updated
+
+
+# Wall-clock budget for the optional min-cost-flow planner (mode="solver"),
+# per run. Capped well below gunicorn's 60s timeout.
+SOLVER_TIME_BUDGET_MS = int(os.environ.get("SOLVER_TIME_BUDGET_MS", "2000"))
+_SOLVER_MAX_BUDGET_MS = 20000
+
+
 @app.route("/api/schedule", methods=["POST"])
 def schedule_technicians():
     data = request.get_json()
     num_technicians = data.get("num_technicians", 1)
+    mode = data.get("mode", "greedy")
 
     session = OurSession()
     try:
@@ -829,47 +941,26 @@ def schedule_technicians():
                 "assignments": [],
             })
 
-        students_df = _students_dataframe()
-
-        faults_data = []
-        for fault in open_faults:
-            student_name = "Unknown"
-            school_name = "Unknown"
-            if not students_df.empty:
-                student_info = students_df[students_df["id"] == fault.student_id_ext]
-                if not student_info.empty:
-                    school_name = student_info.iloc[0].get("school_name", "Unknown")
-                    student_name = f"{student_info.iloc[0]['fname']} {student_info.iloc[0]['lname']}"
-
-            # Lock type drives which equipment the technician needs to bring.
-            # adon_db.get_locker_by_id is TTL-cached so this stays cheap.
-            lock_type = None
-            if fault.locker_id:
-                locker = adon_db.get_locker_by_id(fault.locker_id)
-                if locker:
-                    lock_type = locker.get("lock_type")
-
-            region = get_school_region(school_name)
-            faults_data.append({
-                "fault_id": fault.id,
-                "student_name": student_name,
-                "school_name": school_name,
-                "region": region,
-                "fault_type": fault.fault_type,
-                "severity": fault.severity,
-                "is_urgent": fault.is_urgent,
-                "books_stuck": fault.books_stuck,
-                "is_recurring": getattr(fault, "is_recurring", False),
-                "created_at": fault.created_at,
-                "lock_type": lock_type,
-            })
+        df = _schedule_snapshot(open_faults)
+        distances = geo.get_distance_matrix()
+        solver_report = None
+        if mode == "solver":
+            budget_ms = min(int(data.get("time_budget_ms", SOLVER_TIME_BUDGET_MS)), _SOLVER_MAX_BUDGET_MS)
+            tech_assignments, solver_report = solve_assignment(
+                df, num_technicians, budget_ms / 1000, distances
+            )
+        else:
+            tech_assignments = run_scheduling_algorithm(df, num_technicians, distances)
 
-        df = pd.DataFrame(faults_data)
-        tech_assignments = run_scheduling_algorithm(df, num_technicians)
+        # Driving order per technician (urgent stays first); no-op without coordinates.
+        tech_assignments = {
+            tech_name: order_route(schools, distances, tech_name)
+            for tech_name, schools in tech_assignments.items()
+        }
 
         assignments = []
         # Persist assignments back to the DB so the /technician filter reflects them.
-        fault_by_id = {f.id: f for f in open_faults}
+        fault_ids_by_tech = {}
         for tech_name, schools in tech_assignments.items():
             tech_id = int(tech_name.split()[-1])
             total_score = sum(s["priority_score"] for s in schools)
@@ -878,10 +969,7 @@ def schedule_technicians():
             all_faults = []
             for school in schools:
                 all_faults.extend(school["faults"])
-                for f in school["faults"]:
-                    fid = f.get("fault_id")
-                    if fid in fault_by_id:
-                        fault_by_id[fid].assigned_technician = tech_name
+            fault_ids_by_tech[tech_name] = [f["fault_id"] for f in all_faults]
 
             assignments.append({
                 "technician_id": tech_id,
@@ -891,19 +979,95 @@ def schedule_technicians():
                 "faults": all_faults,
             })
 
+        _persist_assignments(session, fault_ids_by_tech)
         session.commit()
+        _faults_changed()
 
         return jsonify({
             "success": True,
             "num_technicians": num_technicians,
             "assignments": assignments,
+            "solver": solver_report,
         })
     except Exception as e:
+        session.rollback()
         return jsonify({"success": False, "error": str(e)}), 500
     finally:
         session.close()
 
 
+# What-if is a dry run: bounded so one request can't fan out unboundedly.
+_WHAT_IF_MAX_COUNTS = 10
+_WHAT_IF_MAX_TECHNICIANS = 20
+# One deadline for the whole what-if request, shared by all its counts
+# (each may run the solver), so it stays inside gunicorn's 60s timeout.
+_WHAT_IF_DEADLINE_MS = _SOLVER_MAX_BUDGET_MS
+
+
+@app.route("/api/schedule/what-if", methods=["POST"])
+def schedule_what_if():
+    """
+    Plan metrics for several technician counts at once. Never persists anything.
+    Counts not finished within _WHAT_IF_DEADLINE_MS are listed in "timed_out".
+    """
+    data = request.get_json(silent=True) or {}
+    mode = data.get("mode", "greedy")
+
+    try:
+        counts = data.get("technician_counts")
+        if counts is None:
+            lo = int(data.get("min_technicians", 1))
+            hi = int(data.get("max_technicians", lo))
+            counts = range(lo, min(hi, lo + _WHAT_IF_MAX_COUNTS) + 1)
+        counts = sorted({int(n) for n in counts})
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "technician_counts לא תקין"}), 400
+    if not counts or counts[0] < 1 or counts[-1] > _WHAT_IF_MAX_TECHNICIANS:
+        return jsonify({"success": False, "error": f"מספר טכנאים חייב להיות בין 1 ל-{_WHAT_IF_MAX_TECHNICIANS}"}), 400
+    if len(counts) > _WHAT_IF_MAX_COUNTS:
+        return jsonify({"success": False, "error": f"עד {_WHAT_IF_MAX_COUNTS} אפשרויות בבקשה אחת"}), 400
+
+    session = OurSession()
+    try:
+        open_faults = session.query(Fault).filter(Fault.status == "Open").all()
+        if not open_faults:
+            return jsonify({"success": True, "message": "אין תקלות פתוחות", "results": []})
+        df = _schedule_snapshot(open_faults)
+    finally:
+        session.close()
+
+    try:
+        budget_ms = min(int(data.get("time_budget_ms", SOLVER_TIME_BUDGET_MS)), _SOLVER_MAX_BUDGET_MS)
+        results, timed_out = what_if(
+            df, counts, mode=mode, time_budget_s=budget_ms / 1000,
+            distances=geo.get_distance_matrix(), deadline_s=_WHAT_IF_DEADLINE_MS / 1000,
+        )
+        return jsonify({
+            "success": True,
+            "mode": mode,
+            "total_faults": len(df),
+            "results": results,
+            "timed_out": timed_out,
+        })
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/forecast", methods=["GET"])
+def fault_forecast():
+    """
+    Expected new faults per day for the next two weeks, from the last nightly
+    run (see forecasting.py). ?level=region|school|all (default region),
+    optional ?key=<region or school name>.
+    """
+    level = request.args.get("level") or "region"
+    if level not in forecasting.LEVELS:
+        return jsonify({"success": False, "error": f"level must be one of {list(forecasting.LEVELS)}"}), 400
+    with our_engine.connect() as conn:
+        result = forecasting.load(conn, level, request.args.get("key"))
+    return jsonify({"success": True, "level": level, **result})
+
+
 @app.route("/api/student_locker/<student_id>", methods=["GET"])
 def get_student_locker(student_id):
     """Live lookup of the student's current locker from Adon Locker DB."""
@@ -1006,130 +1170,266 @@ def admin_remove_email(email):
     return jsonify({"success": True})
 
 
+def _cached_report_stats(school_filter: str) -> dict:
+    """Stats payload for one filter, shared across workers until the next fault write."""
+    def compute():
+        # History comes from the daily rollup (keyed by school); the live open-fault
+        # figures filter `faults` by that school's student ids (see analytics.py).
+        ids_by_school = adon_db.get_student_ids_by_school()
+        student_ids = ids_by_school.get(school_filter, []) if school_filter else None
+
+        with our_engine.connect() as conn:
+            stats = analytics.report_stats(conn, school_filter or None, student_ids)
+
+        stats["available_schools"] = sorted(ids_by_school)
+        stats["current_filter"] = school_filter
+        return stats
+
+    return shared_state.cached(f"stats:{school_filter}", compute, _REPORT_CACHE_MAX_AGE_SECONDS)
+
+
 @app.route("/api/reports/stats", methods=["GET"])
 def reports_stats():
     """Aggregated stats for the dashboard. Optional ?school=<name> filter."""
     school_filter = (request.args.get("school") or "").strip()
+    return jsonify(_cached_report_stats(school_filter))
+
 
-    df = pd.read_sql("SELECT * FROM faults", our_engine)
-
-    # Enrich with school via Adon Locker DB (cached)
-    students = adon_db.get_all_students()
-    id_to_school = {s["id"]: (s.get("school_name") or "") for s in students}
-    if not df.empty:
-        df["school_name"] = df["student_id_ext"].map(id_to_school).fillna("לא ידוע")
-
-    all_schools = sorted({v for v in id_to_school.values() if v})
-
-    if school_filter and not df.empty:
-        df = df[df["school_name"] == school_filter]
-
-    def value_counts(series, default_label="ללא"):
-        if series.empty:
-            return []
-        return [
-            {"label": (str(k) if k is not None and str(k).lower() != "nan" else default_label), "count": int(v)}
-            for k, v in series.value_counts().items()
-        ]
-
-    total = len(df)
-    open_count = int((df.get("status", pd.Series(dtype=object)) == "Open").sum()) if total else 0
-    closed_count = int((df.get("status", pd.Series(dtype=object)) == "Closed").sum()) if total else 0
-    urgent_open = 0
-    if total and "is_urgent" in df.columns:
-        urgent_open = int(((df["status"] == "Open") & (df["is_urgent"].astype(bool))).sum())
-
-    by_type = value_counts(df["fault_type"]) if total else []
-    by_severity = value_counts(df["severity"]) if total else []
-
-    by_month = []
-    if total and "created_at" in df.columns:
-        ts = pd.to_datetime(df["created_at"], errors="coerce").dropna()
-        if not ts.empty:
-            counts = ts.dt.strftime("%Y-%m").value_counts().sort_index()
-            by_month = [{"label": k, "count": int(v)} for k, v in counts.items()][-12:]
-
-    # Only useful when looking at the org as a whole
-    by_school = value_counts(df["school_name"], default_label="לא ידוע") if (total and not school_filter) else []
-
-    by_technician = []
-    if total:
-        open_df = df[df["status"] == "Open"]
-        if not open_df.empty:
-            techs = open_df["assigned_technician"].fillna("לא הוקצה")
-            by_technician = [{"label": str(k), "count": int(v)} for k, v in techs.value_counts().items()]
+_RESOLUTION_DEFAULT_DAYS = 90
 
+
+@app.route("/api/reports/resolution", methods=["GET"])
+def reports_resolution():
+    """
+    Time-to-resolve (mean / median / p90 / p99) and SLA breach rate for faults
+    closed in a date window, overall and per ?group_by=
+    school|region|fault_type|lock_type|technician.
+
+    Optional: ?from=YYYY-MM-DD&to=YYYY-MM-DD (inclusive, default last 90 days),
+    ?school=<name>, ?sla_hours=<float> (default RESOLUTION_SLA_HOURS).
+    """
+    group_by = request.args.get("group_by") or "school"
+    if group_by not in analytics.RESOLUTION_GROUPS:
+        return jsonify({"error": f"group_by must be one of {sorted(analytics.RESOLUTION_GROUPS)}"}), 400
+    try:
+        today = datetime.utcnow().date()
+        to_day = datetime.strptime(request.args["to"], "%Y-%m-%d").date() if request.args.get("to") else today
+        from_day = (datetime.strptime(request.args["from"], "%Y-%m-%d").date() if request.args.get("from")
+                    else to_day - timedelta(days=_RESOLUTION_DEFAULT_DAYS - 1))
+        sla_hours = float(request.args.get("sla_hours") or analytics.RESOLUTION_SLA_HOURS)
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM-DD and sla_hours a number"}), 400
+    if from_day > to_day or sla_hours <= 0:
+        return jsonify({"error": "from must be <= to and sla_hours > 0"}), 400
+
+    school_filter = (request.args.get("school") or "").strip()
+    start = datetime.combine(from_day, datetime.min.time())
+    end = datetime.combine(to_day + timedelta(days=1), datetime.min.time())
+    cache_key = "resolution:" + json.dumps([start.isoformat(), end.isoformat(), group_by, school_filter, sla_hours])
+    stats = shared_state.cached(
+        cache_key,
+        lambda: analytics.get_resolution_stats(our_engine, start, end, group_by, school_filter or None, sla_hours),
+        _REPORT_CACHE_MAX_AGE_SECONDS,
+    )
+    return jsonify({**stats, "from": from_day.isoformat(), "to": to_day.isoformat(), "current_filter": school_filter})
+
+
+# Default window per granularity when ?from= is omitted (days, inclusive of today).
+_TREND_DEFAULT_DAYS = {"hour": 2, "day": 30, "week": 182, "month": 365}
+
+
+@app.route("/api/reports/trends", methods=["GET"])
+def reports_trends():
+    """
+    Faults opened over time, bucketed in SQL. ?granularity=hour|day|week|month
+    (default day), ?from=YYYY-MM-DD&to=YYYY-MM-DD (inclusive), optional
+    ?breakdown=status|school|fault_type and ?school=<name>. Series are dense
+    (zero-filled) and aligned with "buckets" (UTC bucket starts).
+    """
+    granularity = request.args.get("granularity") or "day"
+    if granularity not in analytics.TREND_GRANULARITIES:
+        return jsonify({"error": f"granularity must be one of {list(analytics.TREND_GRANULARITIES)}"}), 400
+    breakdown = request.args.get("breakdown") or None
+    if breakdown and breakdown not in analytics.TREND_BREAKDOWNS:
+        return jsonify({"error": f"breakdown must be one of {sorted(analytics.TREND_BREAKDOWNS)}"}), 400
+    try:
+        today = datetime.utcnow().date()
+        to_day = datetime.strptime(request.args["to"], "%Y-%m-%d").date() if request.args.get("to") else today
+        from_day = (datetime.strptime(request.args["from"], "%Y-%m-%d").date() if request.args.get("from")
+                    else to_day - timedelta(days=_TREND_DEFAULT_DAYS[granularity] - 1))
+        start = datetime.combine(from_day, datetime.min.time())
+        end = datetime.combine(to_day + timedelta(days=1), datetime.min.time())
+    except (ValueError, OverflowError):
+        return jsonify({"error": "from/to must be YYYY-MM-DD dates within the supported range (before 9999-12-31)"}), 400
+    if from_day > to_day:
+        return jsonify({"error": "from must be <= to"}), 400
+
+    if analytics.bucket_count(start, end, granularity) > analytics.TREND_MAX_BUCKETS:
+        return jsonify({"error": f"יותר מדי נקודות — עד {analytics.TREND_MAX_BUCKETS}; בחרי טווח קצר יותר או רזולוציה גסה יותר"}), 400
+
+    school_filter = (request.args.get("school") or "").strip()
+
+    def compute():
+        student_ids = adon_db.get_student_ids_by_school().get(school_filter, []) if school_filter else None
+        with our_engine.connect() as conn:
+            return analytics.fault_trends(conn, start, end, granularity, breakdown, student_ids)
+
+    cache_key = "trends:" + json.dumps([granularity, from_day.isoformat(), to_day.isoformat(), breakdown, school_filter])
+    trends = shared_state.cached(cache_key, compute, _REPORT_CACHE_MAX_AGE_SECONDS)
+    return jsonify({
+        **trends,
+        "granularity": granularity,
+        "breakdown": breakdown,
+        "from": from_day.isoformat(),
+        "to": to_day.isoformat(),
+        "current_filter": school_filter,
+    })
+
+
+_FAILURE_SCORES_MAX_LIMIT = 200
+
+
+@app.route("/api/reports/failure-scores", methods=["GET"])
+def reports_failure_scores():
+    """
+    Worst lockers / closets / schools by fault rate against the fleet (see
+    failure_scores.py), from the last nightly run. ?level=locker|closet|school
+    (default closet), ?limit=<n> (default 20), ?outliers_only=1, ?school=<name>.
+    """
+    level = request.args.get("level") or "closet"
+    if level not in failure_scores.LEVELS:
+        return jsonify({"error": f"level must be one of {list(failure_scores.LEVELS)}"}), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit") or 20), _FAILURE_SCORES_MAX_LIMIT))
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+    outliers_only = request.args.get("outliers_only") in ("1", "true")
+    school_filter = (request.args.get("school") or "").strip()
+
+    with our_engine.connect() as conn:
+        rows = failure_scores.worst(conn, level, limit, outliers_only, school_filter or None)
     return jsonify({
-        "total": total,
-        "open": open_count,
-        "closed": closed_count,
-        "urgent_open": urgent_open,
-        "by_type": by_type,
-        "by_severity": by_severity,
-        "by_month": by_month,
-        "by_school": by_school,
-        "by_technician": by_technician,
-        "available_schools": all_schools,
+        "level": level,
+        "window_days": failure_scores.FAILURE_SCORE_WINDOW_DAYS,
+        "z_threshold": failure_scores.FAILURE_SCORE_Z_THRESHOLD,
+        "computed_at": rows[0]["computed_at"] if rows else None,
+        "rows": rows,
         "current_filter": school_filter,
     })
 
 
+@app.route("/api/reports/hotspots", methods=["GET"])
+def reports_hotspots():
+    """Fault-burst alerts (see hotspots.py) from the last ?hours= (default 72)."""
+    try:
+        hours = float(request.args.get("hours") or 72)
+    except ValueError:
+        return jsonify({"error": "hours must be a number"}), 400
+    school_filter = (request.args.get("school") or "").strip()
+    try:
+        alerts = hotspots.recent_alerts(hours)
+    except (sqlite3.Error, OSError):
+        alerts = []
+    if school_filter:
+        alerts = [a for a in alerts if a["school"] == school_filter]
+    return jsonify({"alerts": alerts, "hours": hours, "current_filter": school_filter})
+
+
 @app.route("/api/reports/export", methods=["GET"])
 def reports_export():
-    """Download all faults as an Excel file, enriched with student details."""
-    import io
+    """
+    Download faults, enriched with student details (see exports.py).
+    ?format=xlsx (default) | csv (streamed as generated) | parquet (typed,
+    for notebooks). Optional ?from=YYYY-MM-DD&to=YYYY-MM-DD on created_at.
+    """
+    from flask import Response, stream_with_context
+
+    fmt = request.args.get("format") or "xlsx"
+    if fmt not in exports.WRITERS:
+        return jsonify({"error": f"format must be one of {sorted(exports.WRITERS)}"}), 400
+    try:
+        from_day = datetime.strptime(request.args["from"], "%Y-%m-%d").date() if request.args.get("from") else None
+        to_day = datetime.strptime(request.args["to"], "%Y-%m-%d").date() if request.args.get("to") else None
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM-DD"}), 400
+
+    start = datetime.combine(from_day, datetime.min.time()) if from_day else None
+    end = datetime.combine(to_day + timedelta(days=1), datetime.min.time()) if to_day else None
+    stamp = datetime.now().strftime("%Y-%m-%d")
+    chunks = exports.iter_export_chunks(our_engine, start=start, end=end)
+
+    if fmt == "csv":
+        return Response(
+            stream_with_context(exports.iter_csv(chunks)),
+            mimetype=exports.MIMETYPES["csv"],
+            headers={"Content-Disposition": f'attachment; filename="faults-{stamp}.csv"'},
+        )
+
+    path = exports.export_tempfile(fmt, chunks)
+    return Response(
+        exports.iter_file_and_delete(path),
+        mimetype=exports.MIMETYPES[fmt],
+        headers={
+            "Content-Disposition": f'attachment; filename="faults-{stamp}.{fmt}"',
+            "Content-Length": str(os.path.getsize(path)),
+        },
+    )
+
+
+@app.route("/api/reports/export-jobs", methods=["POST"])
+def create_export_job():
+    """
+    Queue a background export. Body: {"format": "xlsx"|"csv"|"parquet", "from": "YYYY-MM-DD",
+    "to": "YYYY-MM-DD", "school": "<name>"} — everything but format optional.
+    Poll GET /api/reports/export-jobs/<id>, then download from .../download.
+    """
+    from auth import current_user
+
+    data = request.get_json(silent=True) or {}
+    fmt = data.get("format") or "xlsx"
+    if fmt not in export_jobs.FORMATS:
+        return jsonify({"error": f"format must be one of {sorted(export_jobs.FORMATS)}"}), 400
+    try:
+        from_day = datetime.strptime(data["from"], "%Y-%m-%d").date() if data.get("from") else None
+        to_day = datetime.strptime(data["to"], "%Y-%m-%d").date() if data.get("to") else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "from/to must be YYYY-MM-DD"}), 400
+    if from_day and to_day and from_day > to_day:
+        return jsonify({"error": "from must be <= to"}), 400
+
+    school = (data.get("school") or "").strip() or None
+    student_ids = adon_db.get_student_ids_by_school().get(school, []) if school else None
+    job = export_jobs.submit(
+        fmt, from_day, to_day, school, student_ids,
+        requested_by=(current_user() or {}).get("email"),
+    )
+    return jsonify(job), 202
+
+
+@app.route("/api/reports/export-jobs/<job_id>", methods=["GET"])
+def export_job_status(job_id):
+    job = export_jobs.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+@app.route("/api/reports/export-jobs/<job_id>/download", methods=["GET"])
+def export_job_download(job_id):
     from flask import send_file
-    df = pd.read_sql("SELECT * FROM faults ORDER BY created_at DESC", our_engine)
-
-    # Enrich with student name + readable ת.ז from Adon Locker DB
-    students = adon_db.get_all_students()
-    id_to_name = {
-        s["id"]: f"{s.get('fname') or ''} {s.get('lname') or ''}".strip() or "לא ידוע"
-        for s in students
-    }
-    id_to_tz = {s["id"]: s.get("studentId") or "" for s in students}
-    id_to_school = {s["id"]: s.get("school_name") or "" for s in students}
-    df["student_name"] = df["student_id_ext"].map(id_to_name).fillna("לא ידוע")
-    df["student_tz"] = df["student_id_ext"].map(id_to_tz).fillna("")
-    df["student_school"] = df["student_id_ext"].map(id_to_school).fillna("")
-    df = df.drop(columns=["student_id_ext"])
-
-    # Lock type — single SQL pulls every locker's closet type at once
-    from sqlalchemy import text as _sql
-    with adon_db.get_adon_engine().connect() as conn:
-        lock_rows = conn.execute(_sql(
-            'SELECT l.id, c.type FROM "Locker" l JOIN "Closet" c ON c.id = l."closetId"'
-        )).fetchall()
-    id_to_locktype = {
-        r[0]: ("דיגיטלי" if r[1] == "Electronic" else "מכני" if r[1] == "Mechanical" else (r[1] or ""))
-        for r in lock_rows
-    }
-    df["lock_type"] = df["locker_id"].map(id_to_locktype).fillna("")
-
-    # Reorder so identifying info comes first
-    front = ["id", "student_name", "student_tz", "student_school", "locker_id", "lock_type"]
-    df = df[front + [c for c in df.columns if c not in front]]
-
-    rename_map = {
-        "id": "מספר תקלה", "student_name": "שם תלמיד",
-        "student_tz": "ת.ז תלמיד", "student_school": "בית ספר",
-        "locker_id": "מזהה לוקר", "lock_type": "סוג מנעול",
-        "fault_type": "סוג תקלה", "severity": "חומרה", "books_stuck": "ספרים תקועים",
-        "is_urgent": "דחוף", "status": "סטטוס", "description": "תיאור",
-        "created_at": "נפתחה ב", "resolved_at": "נסגרה ב",
-        "assigned_technician": "טכנאי", "is_recurring": "חוזרת",
-        "technician_notes": "הערות טכנאי",
-    }
-    df = df.rename(columns={k: v for k, v in rename_map.items() if k in df.columns})
-    buf = io.BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-        df.to_excel(writer, sheet_name="תקלות", index=False)
-    buf.seek(0)
-    from datetime import datetime as _dt
-    fname = f"faults-{_dt.now().strftime('%Y-%m-%d')}.xlsx"
+
+    job = export_jobs.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job["state"] != "done":
+        return jsonify({"error": "הקובץ עדיין לא מוכן", "state": job["state"]}), 409
+    path = export_jobs.artifact_path(job)
+    if not path.exists():
+        return jsonify({"error": "Job not found"}), 404
+    stamp = job["created_at"][:10]
     return send_file(
-        buf, as_attachment=True, download_name=fname,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        path, as_attachment=True, download_name=f"faults-{stamp}.{job['format']}",
+        mimetype=export_jobs.FORMATS[job["format"]],
     )
 
 
@@ -0,0 +1,250 @@
+"""
+Fault-arrival forecast per region and school (nightly batch).
+
+Expected new faults per day for the next FORECAST_HORIZON_DAYS, so dispatch
+can size the technician count ahead of time instead of by gut feel.
+
+History is the `opened` column of `fault_daily_rollup` (analytics.py), one
+zero-filled daily series per school, summed into regions via
+db.get_school_regions() and into an "all" total. Every series gets three
+candidate models, all vectorised over series in NumPy:
+
+  * seasonal_naive  — same weekday last week
+  * seasonal_mean   — mean of the same weekday over the last 4 weeks
+  * smoothing       — exponential smoothing of a weekday-adjusted level
+                      (alpha picked from a small grid)
+
+The candidates are backtested on the last FORECAST_HORIZON_DAYS of history
+(fit on what came before), and each series keeps the model with the lowest
+mean absolute error. Everything runs in well under a second for a year of
+history. Results are written to `fault_forecasts` in one transaction.
+
+Run by the in-app nightly thread (flask_app.py) or by hand:
+    python forecasting.py
+"""
+
+import os
+import sys
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import Column, Date, DateTime, Float, MetaData, String, Table, text
+
+import analytics
+import db as adon_db
+
+FORECAST_HORIZON_DAYS = int(os.environ.get("FORECAST_HORIZON_DAYS", "14"))
+FORECAST_HISTORY_DAYS = int(os.environ.get("FORECAST_HISTORY_DAYS", "365"))
+
+LEVELS = ("region", "school", "all")
+
+SEASON = 7
+_SEASONAL_MEAN_WEEKS = 4
+_SMOOTHING_ALPHAS = (0.1, 0.3, 0.5)
+
+metadata = MetaData()
+
+fault_forecasts = Table(
+    "fault_forecasts", metadata,
+    Column("level", String, primary_key=True),   # region | school | all
+    Column("key", String, primary_key=True),     # region / school name, '' for all
+    Column("day", Date, primary_key=True),
+    Column("expected", Float, nullable=False),
+    Column("model", String, nullable=False),
+    Column("backtest_mae", Float, nullable=True),
+    Column("computed_at", DateTime, nullable=False),
+)
+
+# Postgres advisory lock key, so only one worker runs the job at a time.
+_LOCK_KEY = 4_204_301
+
+
+def ensure_schema(engine) -> None:
+    metadata.create_all(engine)
+
+
+# ============================================================================
+# Models — each maps a (series × days) history to (series × horizon)
+# ============================================================================
+
+def _weekday_positions(n_days: int) -> np.ndarray:
+    # Weekday slot of each history column relative to the forecast origin, so
+    # forecast day h is slot h % 7 whatever day of the week "today" is.
+    return (np.arange(n_days) - n_days) % SEASON
+
+
+def seasonal_naive(history: np.ndarray, horizon: int) -> np.ndarray:
+    last_week = history[:, -SEASON:]
+    return np.tile(last_week, (1, -(-horizon // SEASON)))[:, :horizon]
+
+
+def seasonal_mean(history: np.ndarray, horizon: int) -> np.ndarray:
+    weeks = min(_SEASONAL_MEAN_WEEKS, history.shape[1] // SEASON)
+    recent = history[:, -weeks * SEASON:].reshape(len(history), weeks, SEASON).mean(axis=1)
+    return np.tile(recent, (1, -(-horizon // SEASON)))[:, :horizon]
+
+
+def smoothing(history: np.ndarray, horizon: int, alpha: float) -> np.ndarray:
+    """Simple exponential smoothing of the level, times a multiplicative weekday profile."""
+    n_series, n_days = history.shape
+    pos = _weekday_positions(n_days)
+    overall = history.mean(axis=1, keepdims=True)
+    profile = np.stack([history[:, pos == k].mean(axis=1) for k in range(SEASON)], axis=1)
+    season = np.divide(profile, overall, out=np.ones_like(profile), where=overall > 0)
+
+    level = overall[:, 0].copy()
+    for t in range(n_days):
+        s = season[:, pos[t]]
+        # A weekday that never sees faults (Saturday) says nothing about the level.
+        seen = s > 0
+        level = np.where(seen, alpha * history[:, t] / np.where(seen, s, 1.0) + (1 - alpha) * level, level)
+    return level[:, None] * season[:, np.arange(horizon) % SEASON]
+
+
+_CANDIDATES = {
+    "seasonal_naive": seasonal_naive,
+    "seasonal_mean": seasonal_mean,
+    **{f"smoothing_{a}": (lambda h, n, a=a: smoothing(h, n, a)) for a in _SMOOTHING_ALPHAS},
+}
+
+
+def forecast(history: np.ndarray, horizon: int = FORECAST_HORIZON_DAYS):
+    """
+    (forecast, model name per series, backtest MAE per series) for a
+    (series × days) history. Needs at least horizon + 2 weeks of history to
+    backtest; with less, every series gets seasonal_mean (or the plain mean).
+    """
+    n_series, n_days = history.shape
+    if n_days < SEASON:
+        flat = np.repeat(history.mean(axis=1, keepdims=True), horizon, axis=1)
+        return flat, ["mean"] * n_series, [None] * n_series
+    if n_days < horizon + 2 * SEASON:
+        return np.maximum(seasonal_mean(history, horizon), 0.0), ["seasonal_mean"] * n_series, [None] * n_series
+
+    train, held_out = history[:, :-horizon], history[:, -horizon:]
+    names = list(_CANDIDATES)
+    errors = np.stack([
+        np.abs(_CANDIDATES[name](train, horizon) - held_out).mean(axis=1) for name in names
+    ])                                              # (models × series)
+    best = errors.argmin(axis=0)                    # ties go to the simpler (earlier) model
+    full = np.stack([_CANDIDATES[name](history, horizon) for name in names])
+    chosen = full[best, np.arange(n_series)]
+    mae = errors[best, np.arange(n_series)]
+    return np.maximum(chosen, 0.0), [names[i] for i in best], mae.tolist()
+
+
+# ============================================================================
+# Job
+# ============================================================================
+
+_OPENED_PER_SCHOOL_DAY_SQL = text("""
+    SELECT day, school, SUM(opened) FROM fault_daily_rollup
+    WHERE day >= :start AND day < :end
+    GROUP BY day, school
+""")
+
+
+def compute(engine, today: Optional[date] = None) -> list[dict]:
+    """Forecast rows for every region, school and the total, starting `today`."""
+    today = today or datetime.utcnow().date()
+    start = today - timedelta(days=FORECAST_HISTORY_DAYS)
+    # Today is still filling up, so history ends yesterday.
+    with engine.connect() as conn:
+        rows = conn.execute(_OPENED_PER_SCHOOL_DAY_SQL, {"start": start, "end": today}).fetchall()
+    if not rows:
+        return []
+
+    first_day = min(r[0] for r in rows)
+    n_days = (today - first_day).days
+    schools = sorted({r[1] or analytics.UNKNOWN_SCHOOL for r in rows})
+    school_pos = {s: i for i, s in enumerate(schools)}
+    by_school = np.zeros((len(schools), n_days))
+    for day, school, opened in rows:
+        by_school[school_pos[school or analytics.UNKNOWN_SCHOOL], (day - first_day).days] += opened
+
+    school_regions = adon_db.get_school_regions()
+    region_of = [school_regions.get(s, "Unknown") for s in schools]
+    regions, region_idx = np.unique(np.asarray(region_of, dtype=str), return_inverse=True)
+    by_region = np.zeros((len(regions), n_days))
+    np.add.at(by_region, region_idx, by_school)
+
+    now = datetime.utcnow()
+    days = [today + timedelta(days=h) for h in range(FORECAST_HORIZON_DAYS)]
+    out = []
+    for level, keys, history in (
+        ("school", schools, by_school),
+        ("region", regions.tolist(), by_region),
+        ("all", [""], by_school.sum(axis=0, keepdims=True)),
+    ):
+        expected, models, maes = forecast(history, FORECAST_HORIZON_DAYS)
+        for i, key in enumerate(keys):
+            for h, day in enumerate(days):
+                out.append({
+                    "level": level,
+                    "key": key,
+                    "day": day,
+                    "expected": round(float(expected[i, h]), 3),
+                    "model": models[i],
+                    "backtest_mae": None if maes[i] is None else round(float(maes[i]), 3),
+                    "computed_at": now,
+                })
+    return out
+
+
+def refresh(engine, max_age: Optional[timedelta] = None) -> Optional[int]:
+    """
+    Recompute and replace all forecasts. With `max_age`, skip (return None)
+    if the stored forecast is younger than that. Also returns None if another
+    worker holds the job lock. Otherwise returns the number of rows written.
+    """
+    with engine.begin() as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:k)"), {"k": _LOCK_KEY}).scalar():
+            return None
+        if max_age is not None:
+            last = conn.execute(text("SELECT MAX(computed_at) FROM fault_forecasts")).scalar()
+            if last is not None and datetime.utcnow() - last < max_age:
+                return None
+        rows = compute(engine)
+        conn.execute(fault_forecasts.delete())
+        if rows:
+            conn.execute(fault_forecasts.insert(), rows)
+        return len(rows)
+
+
+def load(conn, level: str, key: Optional[str] = None) -> dict:
+    """Stored forecast for `level` from today on: {"days", "computed_at", "series"}."""
+    params = {"level": level, "today": datetime.utcnow().date()}
+    key_sql = ""
+    if key is not None:
+        key_sql = "AND key = :key"
+        params["key"] = key
+    rows = conn.execute(text(f"""
+        SELECT key, day, expected, model, backtest_mae, computed_at FROM fault_forecasts
+        WHERE level = :level AND day >= :today {key_sql}
+        ORDER BY key, day
+    """), params).fetchall()
+
+    days = sorted({r[1] for r in rows})
+    day_pos = {d: i for i, d in enumerate(days)}
+    series = {}
+    for key_, day, expected, model, mae, _ in rows:
+        s = series.setdefault(key_, {"key": key_, "model": model, "backtest_mae": mae,
+                                     "expected": [0.0] * len(days)})
+        s["expected"][day_pos[day]] = expected
+    for s in series.values():
+        s["total"] = round(sum(s["expected"]), 1)
+    return {
+        "days": [d.isoformat() for d in days],
+        "computed_at": rows[0][5].isoformat() + "Z" if rows else None,
+        "series": sorted(series.values(), key=lambda s: -s["total"]),
+    }
+
+
+if __name__ == "__main__":
+    engine = adon_db.get_our_engine()
+    ensure_schema(engine)
+    written = refresh(engine)
+    if written is None:
+        sys.exit("forecasting: another worker is already running the job")
+    print(f"forecasting: {written} rows")
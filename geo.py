@@ -0,0 +1,116 @@
+"""
+Fine-grained proximity from school / technician coordinates.
+
+REGION_PROXIMITY only knows five coarse regions, so two "Center" schools
+60 km apart look identical. When school_coordinates.json exists next to
+school_regions.json we build a pairwise great-circle distance matrix (km)
+over every school and technician home base, and reuse it until the file's
+mtime changes. Without the file every lookup returns None and callers fall
+back to REGION_PROXIMITY.
+
+File format (see school_coordinates.example.json):
+    {
+      "schools":     {"<school name>": [lat, lon], ...},
+      "technicians": {"<technician name>": [lat, lon], ...}
+    }
+"""
+
+import json
+from pathlib import Path
+from threading import Lock as ThreadLock
+from typing import Optional
+
+import numpy as np
+
+_SCHOOL_COORDS_FILE = Path(__file__).parent / "school_coordinates.json"
+
+# Roughly one REGION_PROXIMITY step, so km distances slot into the same scores.
+KM_PER_PROXIMITY_STEP = 25.0
+
+_EARTH_RADIUS_KM = 6371.0
+
+
+class DistanceMatrix:
+    """Pairwise km distances between named schools and technician home bases."""
+
+    def __init__(self, schools: dict, technicians: dict):
+        names = [("school", n) for n in schools] + [("tech", n) for n in technicians]
+        coords = [schools[n] for n in schools] + [technicians[n] for n in technicians]
+        self._index = {key: i for i, key in enumerate(names)}
+
+        lat, lon = np.radians(np.asarray(coords, dtype=float).reshape(-1, 2)).T
+        dlat = lat[:, None] - lat[None, :]
+        dlon = lon[:, None] - lon[None, :]
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+        self.km = 2 * _EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    def has_school(self, school_name) -> bool:
+        return ("school", school_name) in self._index
+
+    def school_index(self, school_name) -> Optional[int]:
+        return self._index.get(("school", school_name))
+
+    def tech_index(self, tech_name) -> Optional[int]:
+        return self._index.get(("tech", tech_name))
+
+    def school_km(self, a, b) -> Optional[float]:
+        """km between two schools, None if either has no coordinates."""
+        i, j = self.school_index(a), self.school_index(b)
+        if i is None or j is None:
+            return None
+        return float(self.km[i, j])
+
+    def nearest_km(self, school_name, from_schools=(), tech_name=None) -> Optional[float]:
+        """km from `school_name` to the closest of `from_schools` (else the tech's home base)."""
+        j = self.school_index(school_name)
+        if j is None:
+            return None
+        origins = [i for i in (self.school_index(s) for s in from_schools) if i is not None]
+        if not origins and tech_name is not None:
+            home = self.tech_index(tech_name)
+            origins = [home] if home is not None else []
+        if not origins:
+            return None
+        return float(self.km[origins, j].min())
+
+
+_cached: Optional[tuple] = None  # (mtime, DistanceMatrix | None)
+_lock = ThreadLock()
+
+
+def _load(path: Path) -> Optional[DistanceMatrix]:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+    def _points(section):
+        out = {}
+        for name, point in (data.get(section) or {}).items():
+            try:
+                lat, lon = float(point[0]), float(point[1])
+            except (TypeError, ValueError, IndexError):
+                continue
+            out[name] = (lat, lon)
+        return out
+
+    schools, technicians = _points("schools"), _points("technicians")
+    if not schools:
+        return None
+    return DistanceMatrix(schools, technicians)
+
+
+def get_distance_matrix() -> Optional[DistanceMatrix]:
+    """Current matrix, rebuilt only when school_coordinates.json changes. None if absent."""
+    global _cached
+    try:
+        mtime = _SCHOOL_COORDS_FILE.stat().st_mtime
+    except OSError:
+        return None
+    with _lock:
+        if _cached is not None and _cached[0] == mtime:
+            return _cached[1]
+    matrix = _load(_SCHOOL_COORDS_FILE)
+    with _lock:
+        _cached = (mtime, matrix)
+    return matrix
@@ -0,0 +1,208 @@
+"""
+Fault-burst (hotspot) detection per school and per cabinet, as faults come in.
+
+A bad batch of locks or a vandalised closet shows up as a burst of new
+faults in one place. Every created fault (form or bot) is fed to observe_fault(),
+which updates two exponentially-decayed counts for its school and for its
+cabinet (school / cabinet_name, since cabinet names repeat across schools):
+
+    recent    decays with HOTSPOT_WINDOW_HOURS   ≈ faults in the last window
+    baseline  decays with HOTSPOT_BASELINE_DAYS  ≈ faults in the last N days
+
+Both are O(1) state per key (one row in shared_state's SQLite file, updated
+under a write lock so all workers see one stream). The learned baseline gives
+the expected count for a window:
+
+    expected  = baseline × window / baseline period
+    alert if  recent ≥ max(HOTSPOT_MIN_COUNT, expected + HOTSPOT_Z × sqrt(expected))
+
+at most once per window per key. Counts are decayed, so a fault an hour ago
+counts a bit less than one — HOTSPOT_MIN_COUNT is 3.5 to mean "about 4
+faults". Alerts are kept HOTSPOT_ALERT_RETENTION_DAYS in hotspot_alerts.
+
+A fresh deployment learns from live traffic; to seed the baselines from
+history instead:
+    python hotspots.py rebuild
+"""
+
+import logging
+import math
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import text
+
+import db as adon_db
+import shared_state
+
+HOTSPOT_WINDOW_HOURS = float(os.environ.get("HOTSPOT_WINDOW_HOURS", "24"))
+HOTSPOT_BASELINE_DAYS = float(os.environ.get("HOTSPOT_BASELINE_DAYS", "30"))
+HOTSPOT_Z = float(os.environ.get("HOTSPOT_Z", "3.0"))
+HOTSPOT_MIN_COUNT = float(os.environ.get("HOTSPOT_MIN_COUNT", "3.5"))
+HOTSPOT_ALERT_RETENTION_DAYS = 30
+
+KIND_LABELS = {"school": "בית ספר", "cabinet": "ארון"}
+
+logger = logging.getLogger(__name__)
+
+
+def _window_seconds() -> float:
+    return HOTSPOT_WINDOW_HOURS * 3600
+
+
+def _baseline_seconds() -> float:
+    return HOTSPOT_BASELINE_DAYS * 86400
+
+
+def _observe(conn: sqlite3.Connection, kind: str, key: str, school: str, now: float,
+             record_alerts: bool = True) -> Optional[dict]:
+    window, period = _window_seconds(), _baseline_seconds()
+    row = conn.execute(
+        "SELECT updated_at, recent, baseline, last_alert_at FROM hotspot_state WHERE kind = ? AND key = ?",
+        (kind, key),
+    ).fetchone()
+    if row:
+        dt = max(now - row[0], 0.0)
+        recent = row[1] * math.exp(-dt / window)
+        baseline = row[2] * math.exp(-dt / period)
+        last_alert_at = row[3]
+    else:
+        recent = baseline = 0.0
+        last_alert_at = None
+
+    # Expected from what we knew before this fault, so a burst can't raise its own bar.
+    expected = baseline * window / period
+    recent += 1.0
+    baseline += 1.0
+
+    alert = None
+    threshold = max(HOTSPOT_MIN_COUNT, expected + HOTSPOT_Z * math.sqrt(expected))
+    if recent >= threshold and (last_alert_at is None or now - last_alert_at >= window):
+        last_alert_at = now
+        alert = {
+            "kind": kind,
+            "key": key,
+            "school": school,
+            "recent": round(recent, 2),
+            "expected": round(expected, 2),
+            "created_at": datetime.utcfromtimestamp(now).isoformat() + "Z",
+        }
+        if record_alerts:
+            conn.execute(
+                "INSERT INTO hotspot_alerts (kind, key, school, recent, expected, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, key, school, recent, expected, now),
+            )
+
+    conn.execute("""
+        INSERT INTO hotspot_state (kind, key, updated_at, recent, baseline, last_alert_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (kind, key) DO UPDATE SET
+            updated_at = excluded.updated_at,
+            recent = excluded.recent,
+            baseline = excluded.baseline,
+            last_alert_at = excluded.last_alert_at
+    """, (kind, key, now, recent, baseline, last_alert_at))
+    return alert
+
+
+def _keys_for(student_id: Optional[str], locker_id: Optional[str]) -> list[tuple[str, str, str]]:
+    """(kind, key, school) pairs a fault counts towards, from the cached Adon lookups."""
+    locker = adon_db.get_lockers_by_ids([locker_id]).get(locker_id) if locker_id else None
+    school = (locker or {}).get("school_name")
+    if not school and student_id:
+        school = (adon_db.get_student_by_id(student_id) or {}).get("school_name")
+    if not school:
+        return []
+    keys = [("school", school, school)]
+    if locker and locker.get("cabinet_name"):
+        keys.append(("cabinet", f"{school} / {locker['cabinet_name']}", school))
+    return keys
+
+
+def observe_fault(student_id: Optional[str], locker_id: Optional[str],
+                  now: Optional[float] = None) -> list[dict]:
+    """
+    Count a new fault towards its school and cabinet. Returns the alerts it
+    raised (usually none). Never raises: detection must not fail a fault write.
+    """
+    try:
+        keys = _keys_for(student_id, locker_id)
+        if not keys:
+            return []
+        now = time.time() if now is None else now
+        conn = shared_state.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            alerts = [_observe(conn, kind, key, school, now) for kind, key, school in keys]
+            conn.execute("DELETE FROM hotspot_alerts WHERE created_at < ?",
+                         (now - HOTSPOT_ALERT_RETENTION_DAYS * 86400,))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return [a for a in alerts if a]
+    except Exception:
+        logger.exception("detection skipped")
+        return []
+
+
+def recent_alerts(hours: float = 72) -> list[dict]:
+    """Alerts raised in the last `hours`, newest first."""
+    conn = shared_state.connect()
+    try:
+        rows = conn.execute("""
+            SELECT kind, key, school, recent, expected, created_at FROM hotspot_alerts
+            WHERE created_at >= ? ORDER BY created_at DESC
+        """, (time.time() - hours * 3600,)).fetchall()
+    finally:
+        conn.close()
+    return [
+        {
+            "kind": kind,
+            "key": key,
+            "school": school,
+            "recent": round(recent, 2),
+            "expected": round(expected, 2),
+            "created_at": datetime.utcfromtimestamp(created_at).isoformat() + "Z",
+        }
+        for kind, key, school, recent, expected, created_at in rows
+    ]
+
+
+def _epoch(naive_utc: datetime) -> float:
+    return (naive_utc - datetime(1970, 1, 1)).total_seconds()
+
+
+def rebuild(engine) -> int:
+    """
+    Reset the detector state and replay the last 3 baseline periods of
+    faults through it (no alerts recorded). Returns the faults replayed.
+    """
+    since = datetime.utcnow() - timedelta(days=3 * HOTSPOT_BASELINE_DAYS)
+    with engine.connect() as conn:
+        faults = conn.execute(text("""
+            SELECT student_id_ext, locker_id, created_at FROM faults
+            WHERE created_at >= :since ORDER BY created_at
+        """), {"since": since}).fetchall()
+    adon_db.get_lockers_by_ids(f[1] for f in faults if f[1])  # warm the cache in batches
+
+    conn = shared_state.connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM hotspot_state")
+        for student_id, locker_id, created_at in faults:
+            for kind, key, school in _keys_for(student_id, locker_id):
+                _observe(conn, kind, key, school, _epoch(created_at), record_alerts=False)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return len(faults)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python hotspots.py rebuild")
+    print(f"hotspots: replayed {rebuild(adon_db.get_our_engine())} faults")
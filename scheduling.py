@@ -0,0 +1,642 @@
+"""
+Technician scheduling — pure planning logic, no Flask / DB access.
+
+Kept out of flask_app.py so it can be imported cheaply (and run in worker
+processes) without wiring up OAuth or the database engines.
+
+Two planners over the same per-school metrics:
+  * run_scheduling_algorithm — the original three-phase greedy heuristic.
+  * solve_assignment         — optional min-cost-flow planner that keeps the
+                               greedy anchors but re-distributes every other
+                               school by proximity × priority under the same
+                               workload cap. Falls back to the greedy plan if
+                               it runs out of time or can't beat it.
+
+what_if() runs either planner for several technician counts in a process pool
+and returns comparable plan metrics without touching the DB.
+"""
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from datetime import datetime
+
+import numpy as np
+
+from geo import KM_PER_PROXIMITY_STEP
+
+REGION_PROXIMITY = {
+    "South":     {"South": 0, "Lowland": 1, "Jerusalem": 2, "Center": 3, "North": 4},
+    "Jerusalem": {"Jerusalem": 0, "Center": 1, "South": 2, "Lowland": 2, "North": 3},
+    "Center":    {"Center": 0, "Jerusalem": 1, "Lowland": 1, "North": 2, "South": 3},
+    "North":     {"North": 0, "Center": 1, "Lowland": 2, "Jerusalem": 2, "South": 4},
+    "Lowland":   {"Lowland": 0, "Center": 1, "North": 1, "Jerusalem": 2, "South": 2},
+    "Unknown":   {"South": 2, "Jerusalem": 2, "Center": 2, "North": 2, "Lowland": 2},
+}
+
+# Sentinel priority for TOC blockers (books stuck / urgent).
+TOC_PRIORITY = 10000
+
+
+def region_distance(from_region, to_region) -> int:
+    """REGION_PROXIMITY steps between two regions (3 when unknown)."""
+    prox = REGION_PROXIMITY.get(from_region, REGION_PROXIMITY["Unknown"])
+    return prox.get(to_region, 3)
+
+
+def _school_metrics(faults_df):
+    """Per-school priority table, sorted by priority_score (highest first)."""
+    now = datetime.utcnow()
+    faults_df["age_days"] = faults_df["created_at"].apply(
+        lambda x: (now - x).total_seconds() / 86400 if x else 0
+    )
+
+    school_metrics = faults_df.groupby("school_name").agg({
+        "fault_id": "count",
+        "severity": "mean",
+        "age_days": "max",
+        "is_recurring": "max",
+        "is_urgent": "max",
+        "books_stuck": "max",
+        "region": "first",
+    }).reset_index()
+
+    school_metrics.columns = [
+        "school_name", "fault_count", "avg_severity", "max_age_days",
+        "has_recurring", "has_urgent", "has_books_stuck", "region",
+    ]
+
+    # Normalise each component to a [1, 5] scale so weights are comparable.
+    school_metrics["N"] = school_metrics["fault_count"].apply(lambda x: min(x, 5))
+    school_metrics["U"] = school_metrics["avg_severity"]
+    # Fairness: 12-day gradient instead of 5 — gives meaningful priority growth
+    # across a full school fortnight before saturating.
+    school_metrics["T"] = school_metrics["max_age_days"].apply(
+        lambda x: min(1 + (max(x, 0) / 3), 5)
+    )
+    school_metrics["R"] = school_metrics["has_recurring"].apply(lambda x: 5 if x else 1)
+
+    school_metrics["priority_score"] = (
+        0.35 * school_metrics["N"]
+        + 0.25 * school_metrics["U"]
+        + 0.25 * school_metrics["T"]
+        + 0.15 * school_metrics["R"]
+    )
+    # TOC override: blockers (books locked inside the locker, or marked urgent)
+    # jump the entire queue regardless of other components.
+    toc_blocker = (school_metrics["has_urgent"] == True) | (school_metrics["has_books_stuck"] == True)
+    school_metrics.loc[toc_blocker, "priority_score"] = TOC_PRIORITY
+
+    school_metrics = school_metrics.sort_values("priority_score", ascending=False).reset_index(drop=True)
+    school_metrics["assigned"] = False
+    return school_metrics
+
+
+def _school_entry(school, faults_df, region, assignment_type):
+    """One school card in a technician's plan (shape consumed by index.html)."""
+    school_name = school["school_name"]
+    return {
+        "school_name": school_name,
+        "region": region,
+        "priority_score": float(school["priority_score"]),
+        "num_faults": int(school["fault_count"]),
+        "is_urgent": bool(school["has_urgent"]),
+        "avg_severity": float(school["avg_severity"]),
+        "oldest_fault_days": float(school["max_age_days"]),
+        "faults": faults_df[faults_df["school_name"] == school_name].to_dict(orient="records"),
+        "assignment_type": assignment_type,
+    }
+
+
+def _workload_cap(total_faults, num_technicians):
+    return (total_faults / num_technicians) * 1.5
+
+
+def run_scheduling_algorithm(faults_df, num_technicians, distances=None):
+    """
+    Weighted Engineering Heuristic for technician assignment.
+
+    Priority Score (per school) = 0.35*N + 0.25*U + 0.25*T + 0.15*R
+      N  — Batching (35%): clustered faults at one school amortise travel (Benjaafar)
+      U  — RCM (25%): functional severity (1=aesthetic, 5=blocking) (WBDG)
+      T  — Max-Min Fairness (25%): wait time builds priority (Ghaderi)
+      R  — Service Recovery (15%): recurring failures get a boost (Matos)
+
+    TOC override (Theory of Constraints): if any fault at the school is
+    `books_stuck` OR `is_urgent`, score is set to a sentinel that forces
+    that school to the front of the queue.
+
+    Assignment is then done in three phases:
+      Phase 1 — anchor each tech to the next-highest-scoring school
+      Phase 2 — each tech absorbs all unassigned schools in their region
+      Phase 3 — overflow goes to the least-loaded tech
+
+    With a geo.DistanceMatrix (`distances`), Phase 2 absorbs the schools
+    nearest the anchor first, so the workload cap cuts off the far ones, and
+    Phase 3 sends each leftover to the nearest tech that still has room
+    (km where both schools have coordinates, region steps otherwise).
+    """
+    if faults_df.empty:
+        return {}
+
+    school_metrics = _school_metrics(faults_df)
+
+    assignments = {}
+    technician_workload = {}
+    tech_primary_region = {}
+
+    for i in range(1, num_technicians + 1):
+        tech_name = f"טכנאי {i}"
+        assignments[tech_name] = []
+        technician_workload[tech_name] = 0
+        tech_primary_region[tech_name] = None
+
+    workload_cap = _workload_cap(len(faults_df), num_technicians)
+
+    # Phase 1: Anchor seeding
+    num_anchors = min(num_technicians, len(school_metrics))
+    for i in range(num_anchors):
+        school = school_metrics.iloc[i]
+        tech_name = f"טכנאי {i + 1}"
+        region = school["region"]
+
+        assignments[tech_name].append(
+            _school_entry(school, faults_df, region, "Phase 1 - Anchor")
+        )
+        technician_workload[tech_name] += school["fault_count"]
+        tech_primary_region[tech_name] = region
+        school_metrics.loc[i, "assigned"] = True
+
+    tech_names = list(assignments)
+    tech_anchor = {t: schools[0]["school_name"] for t, schools in assignments.items() if schools}
+
+    # Phase 2: Strict region exhaustion
+    for tech_name, primary_region in tech_primary_region.items():
+        if not primary_region:
+            continue
+        region_schools = school_metrics[
+            (~school_metrics["assigned"]) & (school_metrics["region"] == primary_region)
+        ]
+        if distances is not None:
+            km = [distances.school_km(tech_anchor[tech_name], name) for name in region_schools["school_name"]]
+            nearest_first = np.argsort([np.inf if k is None else k for k in km], kind="stable")
+            region_schools = region_schools.iloc[nearest_first]
+        for idx, school in region_schools.iterrows():
+            num_faults = school["fault_count"]
+            if technician_workload[tech_name] + num_faults <= workload_cap:
+                assignments[tech_name].append(
+                    _school_entry(school, faults_df, primary_region, "Phase 2 - Region Absorbed")
+                )
+                technician_workload[tech_name] += num_faults
+                school_metrics.loc[idx, "assigned"] = True
+
+    # Phase 3: Global leftovers
+    steps = None
+    if distances is not None:
+        steps = _travel_steps(school_metrics, tech_names, tech_anchor, tech_primary_region, distances)
+    unassigned_schools = school_metrics[~school_metrics["assigned"]]
+    for idx, school in unassigned_schools.iterrows():
+        best_tech = min(technician_workload.items(), key=lambda x: x[1])[0]
+        if steps is not None:
+            room = [j for j, t in enumerate(tech_names)
+                    if technician_workload[t] + school["fault_count"] <= workload_cap]
+            if room:
+                best_tech = tech_names[min(room, key=lambda j: steps[idx, j])]
+        assignments[best_tech].append(
+            _school_entry(school, faults_df, school["region"], "Phase 3 - Overflow Leftover")
+        )
+        technician_workload[best_tech] += school["fault_count"]
+        school_metrics.loc[idx, "assigned"] = True
+
+    return assignments
+
+
+# ---------------------------------------------------------------------------
+# Optional solver mode — min-cost flow with a wall-clock budget
+#
+# Anchors (Phase 1) are kept as-is: they define each technician's working
+# region. Every other school is a supply node (its fault count), every
+# technician a sink capped at `workload_cap` minus its anchor load, and the
+# per-fault cost of sending school s to technician t is
+#     min(priority_s, SOLVER_BLOCKER_WEIGHT) × distance(anchor_t, s)
+# where distance is REGION_PROXIMITY steps, or km converted to steps when
+# both schools have coordinates (geo.py)
+# so far-away trips hurt more for high-priority schools. The transportation
+# problem is solved exactly by successive shortest paths; the (at most T-1)
+# schools the LP splits are then rounded to their majority technician.
+# ---------------------------------------------------------------------------
+
+# TOC blockers still weigh the most, but a 10000 sentinel would swamp the cost.
+SOLVER_BLOCKER_WEIGHT = 6.0
+# Cost per fault a technician is loaded beyond workload_cap (plan comparison).
+SOLVER_OVERLOAD_PENALTY = 5.0
+
+_EPS = 1e-9
+
+
+def _min_cost_transport(cost, supply, capacity, deadline):
+    """
+    Successive-shortest-path min-cost flow on a bipartite (school × tech) graph.
+
+    Bellman-Ford runs vectorised over the two node layers, so each pass is a
+    couple of NumPy reductions over the S×T cost matrix. Returns the S×T flow
+    matrix, or None if the deadline passes or the demand can't be routed.
+    """
+    n_schools, n_techs = cost.shape
+    flow = np.zeros((n_schools, n_techs))
+    supply = supply.astype(float).copy()
+    capacity = capacity.astype(float).copy()
+    school_idx = np.arange(n_schools)
+    tech_idx = np.arange(n_techs)
+
+    while supply.sum() > _EPS:
+        if time.monotonic() > deadline:
+            return None
+
+        # Distances from the super-source: schools with supply left start at 0,
+        # others are only reachable backwards through existing flow.
+        d_school = np.where(supply > _EPS, 0.0, np.inf)
+        pred_school = np.full(n_schools, -1)  # tech reached from, -1 = source
+        d_tech = np.full(n_techs, np.inf)
+        pred_tech = np.full(n_techs, -1)
+
+        for _ in range(n_schools + n_techs + 1):
+            forward = d_school[:, None] + cost
+            best_s = forward.argmin(axis=0)
+            best_fwd = forward[best_s, tech_idx]
+            improve_t = best_fwd < d_tech - _EPS
+            d_tech = np.where(improve_t, best_fwd, d_tech)
+            pred_tech = np.where(improve_t, best_s, pred_tech)
+
+            backward = np.where(flow > _EPS, d_tech[None, :] - cost, np.inf)
+            best_t = backward.argmin(axis=1)
+            best_bwd = backward[school_idx, best_t]
+            improve_s = best_bwd < d_school - _EPS
+            d_school = np.where(improve_s, best_bwd, d_school)
+            pred_school = np.where(improve_s, best_t, pred_school)
+
+            if not improve_t.any() and not improve_s.any():
+                break
+
+        open_sinks = np.where(capacity > _EPS, d_tech, np.inf)
+        sink = int(open_sinks.argmin())
+        if not np.isfinite(open_sinks[sink]):
+            return None
+
+        # Walk the predecessor tree back to a school that still has supply.
+        forward_edges, backward_edges = [], []
+        t = sink
+        for _ in range(n_schools + n_techs + 1):
+            s = int(pred_tech[t])
+            forward_edges.append((s, t))
+            if pred_school[s] == -1:
+                break
+            t = int(pred_school[s])
+            backward_edges.append((s, t))
+        else:
+            return None
+        origin = forward_edges[-1][0]
+
+        delta = min(supply[origin], capacity[sink])
+        for s, t in backward_edges:
+            delta = min(delta, flow[s, t])
+        if delta <= _EPS:
+            return None
+
+        for s, t in forward_edges:
+            flow[s, t] += delta
+        for s, t in backward_edges:
+            flow[s, t] -= delta
+        supply[origin] -= delta
+        capacity[sink] -= delta
+
+    return flow
+
+
+def _travel_steps(metrics, tech_names, tech_anchor, tech_regions, distances):
+    """
+    S×T matrix of school-to-technician distance in REGION_PROXIMITY steps.
+
+    With a geo.DistanceMatrix, pairs where both the technician's anchor school
+    and the school have coordinates use km / KM_PER_PROXIMITY_STEP instead.
+    """
+    steps = np.empty((len(metrics), len(tech_names)))
+    for i, (school_name, region) in enumerate(zip(metrics["school_name"], metrics["region"])):
+        for j, tech_name in enumerate(tech_names):
+            km = None
+            if distances is not None and tech_anchor.get(tech_name):
+                km = distances.school_km(tech_anchor[tech_name], school_name)
+            if km is not None:
+                steps[i, j] = km / KM_PER_PROXIMITY_STEP
+            else:
+                steps[i, j] = region_distance(tech_regions.get(tech_name), region)
+    return steps
+
+
+def _plan_cost(tech_of_school, tech_names, steps, metrics, workload_cap):
+    """Objective shared by both planners: weighted travel + overload penalty."""
+    weights = np.minimum(metrics["priority_score"].to_numpy(float), SOLVER_BLOCKER_WEIGHT)
+    counts = metrics["fault_count"].to_numpy(float)
+    column = {t: j for j, t in enumerate(tech_names)}
+
+    loads = {}
+    travel = 0.0
+    for i, tech_name in enumerate(tech_of_school):
+        travel += counts[i] * weights[i] * steps[i, column[tech_name]]
+        loads[tech_name] = loads.get(tech_name, 0.0) + counts[i]
+    overload = sum(max(0.0, load - workload_cap) for load in loads.values())
+    return travel + SOLVER_OVERLOAD_PENALTY * overload
+
+
+def solve_assignment(faults_df, num_technicians, time_budget_s=2.0, distances=None):
+    """
+    Optimal(ish) technician-to-school plan within `time_budget_s` seconds.
+
+    `distances` is an optional geo.DistanceMatrix for km-level proximity.
+
+    Returns (assignments, report). `assignments` has the same shape as
+    run_scheduling_algorithm's output; `report` says which plan was used and
+    how much the solver improved on the greedy cost.
+    """
+    started = time.monotonic()
+    deadline = started + max(float(time_budget_s), 0.0)
+
+    greedy = run_scheduling_algorithm(faults_df.copy(), num_technicians, distances)
+    report = {
+        "mode": "solver",
+        "used": "greedy",
+        "greedy_cost": None,
+        "solver_cost": None,
+        "improvement_pct": 0.0,
+        "elapsed_ms": 0.0,
+        "reason": None,
+    }
+
+    def _done(result, reason=None):
+        report["reason"] = reason
+        report["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+        return result, report
+
+    if faults_df.empty or num_technicians < 1:
+        return _done(greedy, "nothing_to_solve")
+
+    metrics = _school_metrics(faults_df)
+    workload_cap = _workload_cap(len(faults_df), num_technicians)
+    school_row = {name: i for i, name in enumerate(metrics["school_name"])}
+
+    # Greedy anchors fix each technician's working region.
+    tech_names = list(greedy.keys())
+    tech_regions = {t: None for t in tech_names}
+    tech_anchor = {}
+    anchor_of = {}
+    greedy_tech = [None] * len(metrics)
+    for tech_name, schools in greedy.items():
+        for entry in schools:
+            greedy_tech[school_row[entry["school_name"]]] = tech_name
+            if entry["assignment_type"] == "Phase 1 - Anchor":
+                anchor_of[school_row[entry["school_name"]]] = tech_name
+                tech_regions[tech_name] = entry["region"]
+                tech_anchor[tech_name] = entry["school_name"]
+
+    steps = _travel_steps(metrics, tech_names, tech_anchor, tech_regions, distances)
+    greedy_cost = _plan_cost(greedy_tech, tech_names, steps, metrics, workload_cap)
+    report["greedy_cost"] = round(float(greedy_cost), 3)
+
+    free_rows = [i for i in range(len(metrics)) if i not in anchor_of]
+    if not free_rows:
+        return _done(greedy, "anchors_only")
+
+    counts = metrics["fault_count"].to_numpy(float)
+    weights = np.minimum(metrics["priority_score"].to_numpy(float), SOLVER_BLOCKER_WEIGHT)
+    cost = weights[free_rows, None] * steps[free_rows]
+    anchor_load = {t: 0.0 for t in tech_names}
+    for i, t in anchor_of.items():
+        anchor_load[t] += counts[i]
+    capacity = np.array([max(workload_cap - anchor_load[t], 0.0) for t in tech_names])
+
+    flow = _min_cost_transport(cost, counts[free_rows], capacity, deadline)
+    if flow is None:
+        reason = "timeout" if time.monotonic() > deadline else "infeasible"
+        return _done(greedy, reason)
+
+    solver_tech = list(greedy_tech)
+    for row, i in enumerate(free_rows):
+        solver_tech[i] = tech_names[int(flow[row].argmax())]
+
+    solver_cost = _plan_cost(solver_tech, tech_names, steps, metrics, workload_cap)
+    report["solver_cost"] = round(float(solver_cost), 3)
+    if solver_cost >= greedy_cost - _EPS:
+        return _done(greedy, "no_improvement")
+
+    assignments = {t: [] for t in tech_names}
+    for i, tech_name in anchor_of.items():
+        school = metrics.iloc[i]
+        assignments[tech_name].append(
+            _school_entry(school, faults_df, school["region"], "Phase 1 - Anchor")
+        )
+    # metrics is priority-sorted, so each technician's list stays in priority order.
+    for i in free_rows:
+        school = metrics.iloc[i]
+        assignments[solver_tech[i]].append(
+            _school_entry(school, faults_df, school["region"], "Solver - Min-Cost Flow")
+        )
+
+    report["used"] = "solver"
+    if greedy_cost > 0:
+        report["improvement_pct"] = round(float(100.0 * (greedy_cost - solver_cost) / greedy_cost), 1)
+    return _done(assignments)
+
+
+# ---------------------------------------------------------------------------
+# What-if: compare plans across technician counts (dry run, nothing persisted)
+#
+# The enriched fault snapshot is handed to each pool worker once through the
+# initializer rather than pickled with every task.
+# ---------------------------------------------------------------------------
+
+_what_if_snapshot = None
+
+# Not fork: the web worker runs background threads, and a forked child can
+# inherit a lock one of them held. The fork server starts once per web worker
+# with this module (NumPy / pandas) already imported, so pool children start fast.
+_POOL_CONTEXT = multiprocessing.get_context("forkserver")
+_POOL_CONTEXT.set_forkserver_preload([__name__])
+
+
+def plan_metrics(assignments) -> dict:
+    """Comparable summary of one plan: loads, region spread, urgent coverage."""
+    loads = [sum(s["num_faults"] for s in schools) for schools in assignments.values()]
+    regions = [len({s["region"] for s in schools}) for schools in assignments.values() if schools]
+    urgent = [s for schools in assignments.values() for s in schools if s["is_urgent"]]
+    urgent_first = sum(1 for schools in assignments.values() if schools and schools[0]["is_urgent"])
+    return {
+        "num_technicians": len(assignments),
+        "loads": loads,
+        "max_load": max(loads, default=0),
+        "min_load": min(loads, default=0),
+        "max_regions_per_tech": max(regions, default=0),
+        "avg_regions_per_tech": round(sum(regions) / len(regions), 2) if regions else 0.0,
+        "urgent_schools": len(urgent),
+        # Share of urgent schools that are some technician's first stop.
+        "urgent_coverage": round(urgent_first / len(urgent), 3) if urgent else 1.0,
+    }
+
+
+def _init_what_if_worker(faults_df):
+    global _what_if_snapshot
+    _what_if_snapshot = faults_df
+
+
+def _what_if_one(task):
+    num_technicians, mode, time_budget_s, distances = task
+    df = _what_if_snapshot.copy()
+    if mode == "solver":
+        assignments, report = solve_assignment(df, num_technicians, time_budget_s, distances)
+    else:
+        assignments, report = run_scheduling_algorithm(df, num_technicians, distances), None
+    metrics = plan_metrics(assignments)
+    metrics["solver"] = report
+    return metrics
+
+
+def what_if(faults_df, technician_counts, mode="greedy", time_budget_s=2.0,
+            distances=None, max_workers=None, deadline_s=None):
+    """
+    Evaluate every technician count in parallel. Returns (results in input
+    order, counts left out).
+
+    With `deadline_s` the whole comparison gets that much wall-clock time:
+    each solver run is budgeted its share of it (and at most `time_budget_s`),
+    and counts still running when it passes are left out rather than waited for.
+    """
+    counts = list(technician_counts)
+    workers = min(len(counts), max_workers or os.cpu_count() or 1)
+    deadline = None if deadline_s is None else time.monotonic() + deadline_s
+    results = {}
+
+    if workers <= 1:
+        _init_what_if_worker(faults_df)
+        for i, n in enumerate(counts):
+            budget = time_budget_s
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                budget = min(time_budget_s, left / (len(counts) - i))
+            results[n] = _what_if_one((n, mode, budget, distances))
+        return [results[n] for n in counts if n in results], [n for n in counts if n not in results]
+
+    if deadline_s is not None:
+        rounds = -(-len(counts) // workers)
+        time_budget_s = min(time_budget_s, deadline_s / rounds)
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=_POOL_CONTEXT,
+        initializer=_init_what_if_worker,
+        initargs=(faults_df,),
+    )
+    try:
+        futures = {pool.submit(_what_if_one, (n, mode, time_budget_s, distances)): n for n in counts}
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+        done, _ = wait(futures, timeout=timeout)
+        results = {futures[f]: f.result() for f in done}
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return [results[n] for n in counts if n in results], [n for n in counts if n not in results]
+
+
+# ---------------------------------------------------------------------------
+# Route ordering — driving order for one technician's school list
+#
+# Urgent / books-stuck schools stay pinned to the front; everything else is
+# ordered by nearest neighbour then improved with 2-opt, over the cached
+# geo.DistanceMatrix. Schools without coordinates keep their priority order
+# at the end of the route.
+# ---------------------------------------------------------------------------
+
+def _two_opt(d, path, max_passes=50):
+    """Improve an open path in place; path[0] is a fixed origin."""
+    n = len(path)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n - 1):
+            a, b = path[i - 1], path[i]
+            for j in range(i + 1, n):
+                c = path[j]
+                e = path[j + 1] if j + 1 < n else None
+                before = d[a, b] + (d[c, e] if e is not None else 0.0)
+                after = d[a, c] + (d[b, e] if e is not None else 0.0)
+                if after < before - 1e-9:
+                    path[i:j + 1] = path[i:j + 1][::-1]
+                    a, b = path[i - 1], path[i]
+                    improved = True
+        if not improved:
+            break
+    return path
+
+
+def _open_path(d, origin, nodes):
+    """Nearest-neighbour + 2-opt order of `nodes` starting from `origin` (or nodes[0])."""
+    if not nodes:
+        return []
+    remaining = list(nodes)
+    if origin is None:
+        origin = remaining.pop(0)
+        path = [origin]
+    else:
+        path = [origin]
+    while remaining:
+        last = path[-1]
+        nxt = min(remaining, key=lambda k: d[last, k])
+        remaining.remove(nxt)
+        path.append(nxt)
+    _two_opt(d, path)
+    return path if origin in nodes else path[1:]
+
+
+def order_route(schools, distances, tech_name=None):
+    """
+    Return `schools` (one technician's plan entries) in driving order.
+
+    Each entry gains `route_order` (1-based) and `leg_km` (from the previous
+    stop / home base; None when unknown). Without a distance matrix the
+    priority order is kept.
+    """
+    def _pinned(entry):
+        return entry["is_urgent"] or any(f.get("books_stuck") for f in entry["faults"])
+
+    ordered = list(schools)
+    if distances is not None and len(schools) > 1:
+        located = [e for e in schools if distances.has_school(e["school_name"])]
+        unlocated = [e for e in schools if not distances.has_school(e["school_name"])]
+        node_of = {id(e): distances.school_index(e["school_name"]) for e in located}
+        home = distances.tech_index(tech_name) if tech_name else None
+
+        pinned = [node_of[id(e)] for e in located if _pinned(e)]
+        rest = [node_of[id(e)] for e in located if not _pinned(e)]
+        head = _open_path(distances.km, home, pinned)
+        tail_origin = head[-1] if head else home
+        tail = _open_path(distances.km, tail_origin, rest)
+
+        by_node = {}
+        for e in located:
+            by_node.setdefault(node_of[id(e)], []).append(e)
+        ordered = [e for node in head + tail for e in by_node.pop(node, [])]
+        # Unlocated urgent schools still go before the routed non-urgent ones.
+        ordered = (
+            [e for e in ordered if _pinned(e)]
+            + [e for e in unlocated if _pinned(e)]
+            + [e for e in ordered if not _pinned(e)]
+            + [e for e in unlocated if not _pinned(e)]
+        )
+
+    prev = distances.tech_index(tech_name) if (distances is not None and tech_name) else None
+    result = []
+    for position, entry in enumerate(ordered, start=1):
+        node = distances.school_index(entry["school_name"]) if distances is not None else None
+        leg = float(distances.km[prev, node]) if (prev is not None and node is not None) else None
+        result.append({**entry, "route_order": position, "leg_km": round(leg, 1) if leg is not None else None})
+        if node is not None:
+            prev = node
+    return result
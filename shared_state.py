@@ -0,0 +1,230 @@
+"""
+State shared by all gunicorn workers, in a small SQLite file on the /app/data
+volume (same idea as allowed_emails.json, but with atomic counters).
+
+  * generation — a counter every fault write bumps (bump_generation()).
+    Anything derived from `faults` can be cached against the generation it
+    was computed at, and stays valid until the next write — in every worker,
+    not just the one that handled the write.
+  * report_cache — per-filter report responses, keyed by generation.
+  * hotspot_state / hotspot_alerts — the fault-burst detector (hotspots.py).
+  * rate_buckets / inflight — token buckets and in-flight request caps
+    (the /api/bot/* limiter in bot_api.py).
+
+SQLite runs in WAL mode with a busy timeout, so readers never block and
+writers just queue briefly. Each call opens its own short-lived connection.
+If the file can't be opened (no data volume), cached() just computes and
+callers treat the generation as unknown — slower, never wrong.
+"""
+
+import json
+import os
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+SHARED_STATE_DB = Path(os.environ.get("SHARED_STATE_DB", "/app/data/shared_state.sqlite3"))
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS counters (
+        name  TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS report_cache (
+        key        TEXT PRIMARY KEY,
+        generation INTEGER NOT NULL,
+        payload    TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS hotspot_state (
+        kind          TEXT NOT NULL,
+        key           TEXT NOT NULL,
+        updated_at    REAL NOT NULL,
+        recent        REAL NOT NULL,
+        baseline      REAL NOT NULL,
+        last_alert_at REAL,
+        PRIMARY KEY (kind, key)
+    );
+    CREATE TABLE IF NOT EXISTS hotspot_alerts (
+        id         INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind       TEXT NOT NULL,
+        key        TEXT NOT NULL,
+        school     TEXT NOT NULL,
+        recent     REAL NOT NULL,
+        expected   REAL NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS ix_hotspot_alerts_created_at ON hotspot_alerts (created_at);
+    CREATE TABLE IF NOT EXISTS rate_buckets (
+        name       TEXT PRIMARY KEY,
+        tokens     REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS inflight (
+        ticket     TEXT PRIMARY KEY,
+        name       TEXT NOT NULL,
+        started_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS ix_inflight_name ON inflight (name, started_at);
+"""
+
+_initialised_for: Optional[Path] = None
+
+
+def connect() -> sqlite3.Connection:
+    """A fresh autocommit connection to the shared file (schema created on first use)."""
+    global _initialised_for
+    if _initialised_for != SHARED_STATE_DB:
+        SHARED_STATE_DB.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(SHARED_STATE_DB, timeout=5.0, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    if _initialised_for != SHARED_STATE_DB:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.executescript(_SCHEMA)
+        _initialised_for = SHARED_STATE_DB
+    return conn
+
+
+# ---------------------------------------------------------------------------
+# Generation counter
+# ---------------------------------------------------------------------------
+
+def current_generation() -> int:
+    conn = connect()
+    try:
+        row = conn.execute("SELECT value FROM counters WHERE name = 'faults'").fetchone()
+        return row[0] if row else 0
+    finally:
+        conn.close()
+
+
+def bump_generation() -> int:
+    """Mark every cached fault-derived result stale (all workers). Returns the new generation."""
+    conn = connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""
+            INSERT INTO counters (name, value) VALUES ('faults', 1)
+            ON CONFLICT (name) DO UPDATE SET value = value + 1
+        """)
+        generation = conn.execute("SELECT value FROM counters WHERE name = 'faults'").fetchone()[0]
+        conn.execute("DELETE FROM report_cache WHERE generation < ?", (generation,))
+        conn.execute("COMMIT")
+        return generation
+    finally:
+        conn.close()
+
+
+# ---------------------------------------------------------------------------
+# Report cache
+# ---------------------------------------------------------------------------
+
+def cache_get(key: str, max_age_seconds: Optional[float] = None):
+    """Cached payload for `key` if computed at the current generation (and young enough)."""
+    conn = connect()
+    try:
+        row = conn.execute("""
+            SELECT c.payload, c.created_at FROM report_cache c
+            WHERE c.key = ?
+              AND c.generation = COALESCE((SELECT value FROM counters WHERE name = 'faults'), 0)
+        """, (key,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    if max_age_seconds is not None and time.time() - row[1] > max_age_seconds:
+        return None
+    return json.loads(row[0])
+
+
+def cache_put(key: str, generation: int, payload) -> None:
+    """
+    Store `payload` as computed at `generation`. Read the generation BEFORE
+    computing: if a write lands mid-computation the entry is born stale.
+    """
+    conn = connect()
+    try:
+        conn.execute("""
+            INSERT INTO report_cache (key, generation, payload, created_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                generation = excluded.generation,
+                payload = excluded.payload,
+                created_at = excluded.created_at
+            WHERE excluded.generation >= report_cache.generation
+        """, (key, generation, json.dumps(payload, ensure_ascii=False, default=str), time.time()))
+    finally:
+        conn.close()
+
+
+def cached(key: str, compute, max_age_seconds: Optional[float] = None):
+    """cache_get(key) or compute() stored at the generation read before computing."""
+    try:
+        hit = cache_get(key, max_age_seconds)
+        if hit is not None:
+            return hit
+        generation = current_generation()
+    except (sqlite3.Error, OSError):
+        return compute()
+    payload = compute()
+    try:
+        cache_put(key, generation, payload)
+    except (sqlite3.Error, OSError):
+        pass
+    return payload
+
+
+# ---------------------------------------------------------------------------
+# Rate limiting
+# ---------------------------------------------------------------------------
+
+def admit(name: str, rate: float, burst: float, max_inflight: int,
+          stale_after: float = 120.0) -> tuple[Optional[str], float, str]:
+    """
+    Let one request for `name` in, if it is under `max_inflight` concurrent
+    requests and its token bucket (refilling `rate` per second, holding up
+    to `burst`) has a token. Checked and updated atomically across workers.
+
+    Returns (ticket, 0.0, "") when admitted — pass the ticket to release()
+    when the request ends — or (None, retry_after_seconds, "concurrency" | "rate").
+    In-flight entries older than `stale_after` (a killed worker never
+    released them) no longer count.
+    """
+    if rate <= 0 or burst < 1 or max_inflight < 1:
+        raise ValueError("admit() needs rate > 0, burst >= 1 and max_inflight >= 1")
+    now = time.time()
+    conn = connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM inflight WHERE name = ? AND started_at < ?", (name, now - stale_after))
+        inflight = conn.execute("SELECT COUNT(*) FROM inflight WHERE name = ?", (name,)).fetchone()[0]
+        if inflight >= max_inflight:
+            conn.execute("COMMIT")
+            return None, 1.0, "concurrency"
+
+        row = conn.execute("SELECT tokens, updated_at FROM rate_buckets WHERE name = ?", (name,)).fetchone()
+        tokens = burst if row is None else min(burst, row[0] + max(now - row[1], 0.0) * rate)
+        if tokens < 1.0:
+            conn.execute("COMMIT")
+            return None, (1.0 - tokens) / rate, "rate"
+
+        ticket = uuid.uuid4().hex
+        conn.execute("""
+            INSERT INTO rate_buckets (name, tokens, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at
+        """, (name, tokens - 1.0, now))
+        conn.execute("INSERT INTO inflight (ticket, name, started_at) VALUES (?, ?, ?)", (ticket, name, now))
+        conn.execute("COMMIT")
+        return ticket, 0.0, ""
+    finally:
+        conn.close()
+
+
+def release(ticket: str) -> None:
+    """End an admitted request (see admit())."""
+    conn = connect()
+    try:
+        conn.execute("DELETE FROM inflight WHERE ticket = ?", (ticket,))
+    finally:
+        conn.close()
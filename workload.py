@@ -0,0 +1,83 @@
+"""
+Technician workload — shared by /api/technicians and /api/suggest_technician.
+
+One GROUP BY over open, assigned faults gives the per-technician counts
+(split by student, so we can derive regions without loading fault rows).
+Students map to school -> region through the indexed lookups in db.py.
+
+The result is cached in-process against the shared fault generation
+(shared_state.py), so a write handled by either gunicorn worker invalidates
+it in both. The entry also expires after the Adon cache TTL, since the
+student -> school mapping can change without any fault write.
+"""
+
+import os
+import sqlite3
+import time
+from collections import Counter
+from threading import Lock as ThreadLock
+
+from sqlalchemy import text
+
+import db as adon_db
+import shared_state
+
+_WORKLOAD_TTL_SECONDS = int(os.environ.get("ADON_CACHE_TTL_SECONDS", "60"))
+
+_WORKLOAD_SQL = text("""
+    SELECT assigned_technician, student_id_ext, COUNT(*) AS n
+    FROM faults
+    WHERE status = 'Open' AND assigned_technician IS NOT NULL
+    GROUP BY assigned_technician, student_id_ext
+""")
+
+_cached = None  # (workload, generation, expires_at_monotonic)
+_lock = ThreadLock()
+
+
+def _generation():
+    try:
+        return shared_state.current_generation()
+    except (sqlite3.Error, OSError):
+        return None  # no shared state: fall back to the TTL alone
+
+
+def _compute() -> dict:
+    with adon_db.get_our_engine().connect() as conn:
+        rows = conn.execute(_WORKLOAD_SQL).fetchall()
+
+    workload = {}
+    for tech, student_id, n in rows:
+        wl = workload.setdefault(tech, {"count": 0, "regions": Counter(), "schools": Counter()})
+        wl["count"] += n
+        student = adon_db.get_student_by_id(student_id)
+        if student:
+            school_name = student.get("school_name")
+            wl["regions"][adon_db.get_region_for_school(school_name)] += n
+            if school_name:
+                wl["schools"][school_name] += n
+
+    for wl in workload.values():
+        wl["current_region"] = wl["regions"].most_common(1)[0][0] if wl["regions"] else None
+    return workload
+
+
+def get_workload() -> dict:
+    """{technician: {"count", "regions", "schools" (Counters), "current_region"}} for open faults."""
+    global _cached
+    generation = _generation()
+    with _lock:
+        if _cached is not None and _cached[1] == generation and time.monotonic() < _cached[2]:
+            return _cached[0]
+    workload = _compute()
+    with _lock:
+        _cached = (workload, generation, time.monotonic() + _WORKLOAD_TTL_SECONDS)
+    return workload
+
+
+def technician_load(tech: dict) -> tuple[int, str, list]:
+    """(open fault count, current region, schools with open faults) for a TECHNICIANS entry."""
+    wl = get_workload().get(tech["name"])
+    if not wl:
+        return 0, tech["home_region"], []
+    return wl["count"], wl["current_region"] or tech["home_region"], list(wl["schools"])